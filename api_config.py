@@ -0,0 +1,116 @@
+import json
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+from checkpoint import atomic_write
+from decoding import DECODE_ERRORS, decode_json
+from dm_client import DEFAULT_API_URL, HEADERS
+
+DEFAULT_API_CONFIG = "api_config.json"
+PROBE_TIMEOUT = 10  # Seconds
+API_URLS = (DEFAULT_API_URL, "https://i.instagram.com/api/v1")
+
+
+def header_configs(sessionid: str) -> dict:
+    """The header sets worth trying by name, the first one is what the scraper sends by default"""
+    return {
+        "Web Browser Style": HEADERS,
+        "Web Browser Style + CSRF": {**HEADERS, "x-csrftoken": sessionid[:32]},  # Part of the session as csrf
+        "Mobile App Style": {
+            "accept": "*/*",
+            "accept-language": "en-US,en;q=0.9",
+            "user-agent": "Instagram 275.0.0.27.98 Android (33/13; 420dpi; 1080x2340; samsung; SM-G991B; o1s; exynos2100; en_US; 458229237)",
+            "x-ig-app-id": "567067343352427",
+        },
+        "Minimal Headers": {
+            "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36",
+        },
+    }
+
+
+def probe_url(api_url: str, thread_id: str | None = None) -> str:
+    """A cheap request that needs a working configuration: the chat's newest page, or one inbox entry"""
+    if thread_id:
+        return f"{api_url}/direct_v2/threads/{thread_id}/"
+    return f"{api_url}/direct_v2/inbox/?persistentBadging=true&folder=&limit=1"
+
+
+def probe_one(sessionid: str, name: str, headers: dict, api_url: str, thread_id: str | None = None,
+              timeout: float = PROBE_TIMEOUT) -> dict:
+    """Try one configuration, returns what happened and how long it took.
+
+    "ok" is only set when the response is the JSON the scraper expects
+    ("thread" or "inbox"), which is then kept in "response".
+    """
+    url = probe_url(api_url, thread_id)
+    result = {"name": name, "api_url": api_url, "url": url, "status": None, "seconds": None, "ok": False,
+              "error": None, "response": None}
+    started = time.perf_counter()
+    try:
+        r = requests.get(url, headers=headers, cookies={"sessionid": sessionid}, timeout=timeout)
+    except requests.exceptions.RequestException as e:
+        result["error"] = str(e)
+        return result
+    result["seconds"] = time.perf_counter() - started
+    result["status"] = r.status_code
+
+    try:
+        data = decode_json(r.content)
+    except DECODE_ERRORS:
+        result["error"] = f"Not JSON: {r.text[:200]}"
+        return result
+    key = "thread" if thread_id else "inbox"
+    if r.status_code == 200 and isinstance(data, dict) and key in data:
+        result["ok"] = True
+        result["response"] = data
+    elif isinstance(data, dict) and "message" in data:
+        result["error"] = data["message"]
+    else:
+        result["error"] = str(data)[:200]
+    return result
+
+
+def probe(sessionid: str, thread_id: str | None = None, api_urls=API_URLS, timeout: float = PROBE_TIMEOUT) -> list:
+    """Try every header configuration against every API url at the same time.
+
+    Returns the results with the working ones first, fastest first, so a
+    full probe takes about as long as the slowest single request instead
+    of the sum of them.
+    """
+    candidates = [(name, headers, api_url) for api_url in api_urls for name, headers in header_configs(sessionid).items()]
+    with ThreadPoolExecutor(max_workers=len(candidates)) as pool:
+        results = list(pool.map(lambda candidate: probe_one(sessionid, *candidate, thread_id, timeout), candidates))
+    return sorted(results, key=lambda result: (not result["ok"], result["seconds"] if result["seconds"] is not None else timeout))
+
+
+class ApiConfigCache:
+    """The API url and header configuration that last won a probe, kept between runs.
+
+    Only the configuration's name is written (its headers are rebuilt
+    from the sessionid, one of them holds part of it), for the account
+    the probe was made with, like InboxCache.
+    """
+
+    def __init__(self, path: str, sessionid: str):
+        self.path = path
+        self.sessionid = sessionid
+        self.account = sessionid[-8:]
+
+    def load(self) -> dict | None:
+        """The saved configuration with its headers, None if there is none for this account"""
+        try:
+            with open(self.path, encoding="UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        headers = header_configs(self.sessionid).get(data.get("name"))
+        if data.get("account") != self.account or headers is None or not data.get("api_url"):
+            return None
+        return {**data, "headers": headers}
+
+    def save(self, result: dict):
+        atomic_write(self.path, json.dumps({"account": self.account, "name": result["name"], "api_url": result["api_url"],
+                                            "seconds": result["seconds"], "checked_at": time.time()}))
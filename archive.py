@@ -0,0 +1,233 @@
+import hashlib
+import heapq
+import json
+import mmap
+import os
+import struct
+import zlib
+from functools import lru_cache
+
+from decoding import decode_json
+
+try:
+    import zstandard
+except ImportError:  # Optional, archives are zlib-compressed without it
+    zstandard = None
+
+SEGMENT_ROWS = 2000  # Messages per compressed segment
+SEGMENT_CACHE = 8  # Decompressed segments an ArchiveReader keeps
+ZSTD_LEVEL = 10
+ZLIB_LEVEL = 9
+ITEM_ID_SIZE = 16
+
+META_FILE = "archive.json"
+INDEX_FILE = "index.bin"
+ARCHIVE_VERSION = 1
+
+# One index entry per message, sorted by timestamp: (timestamp, item_id, segment, offset)
+# where offset is where the message's line starts in the decompressed segment
+INDEX_ENTRY = struct.Struct(f"<q{ITEM_ID_SIZE}sII")
+TIMESTAMP = struct.Struct("<q")
+
+
+def compressor(codec: str):
+    """(compress, decompress) functions of a codec"""
+    if codec == "zstd":
+        if zstandard is None:
+            raise RuntimeError("This archive is zstd-compressed, install zstandard to use it (`pip install zstandard`)")
+        return zstandard.ZstdCompressor(level=ZSTD_LEVEL).compress, zstandard.ZstdDecompressor().decompress
+    if codec == "zlib":
+        return (lambda data: zlib.compress(data, ZLIB_LEVEL)), zlib.decompress
+    raise RuntimeError(f"Unknown archive codec {codec!r}")
+
+
+def read_meta(path: str) -> dict | None:
+    meta_path = os.path.join(path, META_FILE)
+    if not os.path.isfile(meta_path):
+        return None
+    with open(meta_path, encoding="UTF-8") as f:
+        return json.load(f)
+
+
+def segment_path(path: str, segment: int) -> str:
+    return os.path.join(path, f"{segment:08d}.seg")
+
+
+def pack_item_id(item_id) -> bytes:
+    """The fixed-width index form of an item id: the number itself (Instagram's ids are), a hash of anything else"""
+    text = str(item_id)
+    if text.isascii() and text.isdigit() and int(text) < 1 << (8 * ITEM_ID_SIZE):
+        return int(text).to_bytes(ITEM_ID_SIZE, "big")
+    return hashlib.blake2b(text.encode("UTF-8"), digest_size=ITEM_ID_SIZE).digest()
+
+
+class ArchiveExport:
+    """Append-only archive of one chat: compressed segments plus a timestamp index.
+
+    The archive is a folder. Rows (export.EXPORT_FIELDS order) are
+    collected into segments of SEGMENT_ROWS messages, each one JSON array
+    per line and compressed on its own (zstd when zstandard is installed,
+    zlib otherwise), so reading a message only decompresses its segment.
+    index.bin has one fixed-width INDEX_ENTRY per message sorted by
+    timestamp, which ArchiveReader memory-maps and binary searches.
+
+    Exporting into an existing archive only adds the messages it doesn't
+    have yet. Segments are never changed once written; the index is
+    appended to when the new messages are newer than everything in it and
+    rewritten in order (atomically) when they are not.
+    """
+
+    def __init__(self, path: str, segment_rows: int = SEGMENT_ROWS):
+        self.path = path
+        self.segment_rows = segment_rows
+        self.lines = 0
+        os.makedirs(path, exist_ok=True)
+        meta = read_meta(path)
+        if meta is None:
+            meta = {"version": ARCHIVE_VERSION, "codec": "zstd" if zstandard is not None else "zlib"}
+            with open(os.path.join(path, META_FILE), "w", encoding="UTF-8") as f:
+                json.dump(meta, f)
+        self._compress = compressor(meta["codec"])[0]
+        self.index_path = os.path.join(path, INDEX_FILE)
+
+        self._ids = set()
+        self._newest = None
+        self._next_segment = 0
+        if os.path.isfile(self.index_path):
+            with open(self.index_path, "rb") as f:
+                data = f.read()
+            for timestamp, item_id, segment, _ in INDEX_ENTRY.iter_unpack(data[:len(data) - len(data) % INDEX_ENTRY.size]):
+                self._ids.add(item_id)
+                self._newest = timestamp if self._newest is None else max(self._newest, timestamp)
+                self._next_segment = max(self._next_segment, segment + 1)
+        self._rows: list = []
+        self._entries: list = []  # Index entries of the new segments, in the order written
+
+    def write_page(self, rows: list):
+        """Add rows (any order), skipping messages the archive already has"""
+        for row in rows:
+            item_id = pack_item_id(row[0])
+            if item_id in self._ids:
+                continue
+            self._ids.add(item_id)
+            self._rows.append(row)
+        if len(self._rows) >= self.segment_rows:
+            self._write_segment()
+
+    def _write_segment(self):
+        rows, self._rows = self._rows, []
+        if not rows:
+            return
+        rows.sort(key=lambda row: row[7])
+        segment = self._next_segment
+        lines, offset = [], 0
+        for row in rows:
+            line = (json.dumps(row, ensure_ascii=False, separators=(",", ":")) + "\n").encode("UTF-8")
+            self._entries.append((row[7], pack_item_id(row[0]), segment, offset))
+            lines.append(line)
+            offset += len(line)
+
+        tmp_path = f"{segment_path(self.path, segment)}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(self._compress(b"".join(lines)))
+        os.replace(tmp_path, segment_path(self.path, segment))
+        self._next_segment += 1
+        self.lines += len(rows)
+
+    def finalize(self):
+        """Write the last segment and bring the index up to date"""
+        self._write_segment()
+        entries, self._entries = self._entries, []
+        if not entries:
+            return
+        entries.sort(key=lambda entry: entry[0])
+        if self._newest is None or entries[0][0] >= self._newest:
+            with open(self.index_path, "ab") as f:
+                f.write(b"".join(INDEX_ENTRY.pack(*entry) for entry in entries))
+        else:
+            self._rewrite_index(entries)
+        self._newest = entries[-1][0] if self._newest is None else max(self._newest, entries[-1][0])
+
+    def _rewrite_index(self, entries: list):
+        with open(self.index_path, "rb") as f:
+            data = f.read()
+        size = len(data) - len(data) % INDEX_ENTRY.size
+        old = [data[start:start + INDEX_ENTRY.size] for start in range(0, size, INDEX_ENTRY.size)]
+        new = [INDEX_ENTRY.pack(*entry) for entry in entries]
+        merged = heapq.merge(old, new, key=lambda entry: TIMESTAMP.unpack_from(entry)[0])
+        tmp_path = f"{self.index_path}.tmp"
+        with open(tmp_path, "wb") as f:
+            f.write(b"".join(merged))
+        os.replace(tmp_path, self.index_path)
+
+
+class ArchiveReader:
+    """Reads ranges of an archive written by ArchiveExport.
+
+    The index is memory-mapped and binary searched in place, so finding a
+    date costs O(log n) page reads whatever the size of the archive, and
+    only the segments holding the requested messages are decompressed (the
+    last SEGMENT_CACHE of them are kept).
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        meta = read_meta(path)
+        if meta is None:
+            raise FileNotFoundError(f"No archive at {path}")
+        self._decompress = compressor(meta["codec"])[1]
+        self._segment = lru_cache(maxsize=SEGMENT_CACHE)(self._read_segment)
+
+        self._map = None
+        index_path = os.path.join(path, INDEX_FILE)
+        if os.path.isfile(index_path) and os.path.getsize(index_path):
+            with open(index_path, "rb") as f:
+                self._map = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+        self._index = memoryview(self._map) if self._map is not None else memoryview(b"")
+        self.count = len(self._index) // INDEX_ENTRY.size
+
+    def __len__(self):
+        return self.count
+
+    def timestamp(self, position: int) -> int:
+        return TIMESTAMP.unpack_from(self._index, position * INDEX_ENTRY.size)[0]
+
+    def bisect(self, timestamp: int, right: bool = False) -> int:
+        """Position of the first message at or after timestamp (after it with right)"""
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            value = self.timestamp(middle)
+            if value < timestamp or (right and value == timestamp):
+                low = middle + 1
+            else:
+                high = middle
+        return low
+
+    def span(self, since: int | None = None, until: int | None = None) -> range:
+        """Positions of the messages from since to until (microseconds, both included)"""
+        start = self.bisect(since) if since is not None else 0
+        end = self.bisect(until, right=True) if until is not None else self.count
+        return range(start, max(start, end))
+
+    def read(self, positions: range):
+        """Rows (export.EXPORT_FIELDS order) at the given positions, oldest first"""
+        for position in positions:
+            _, _, segment, offset = INDEX_ENTRY.unpack_from(self._index, position * INDEX_ENTRY.size)
+            data = self._segment(segment)
+            yield tuple(decode_json(data[offset:data.index(b"\n", offset)]))
+
+    def _read_segment(self, segment: int) -> bytes:
+        with open(segment_path(self.path, segment), "rb") as f:
+            return self._decompress(f.read())
+
+    def close(self):
+        self._index.release()
+        if self._map is not None:
+            self._map.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
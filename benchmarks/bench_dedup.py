@@ -0,0 +1,69 @@
+"""Benchmark for the duplicate check in get_all_messages.
+
+Feeds synthetic cursor pages straight into get_all_messages through a
+DMClient whose get_page() serves them (no network, no sleeps) and reports
+CPU time per message for growing thread sizes. With the hash index the
+per-message cost should stay flat, i.e. total time grows linearly with
+the thread size.
+
+Usage: python benchmarks/bench_dedup.py [--sizes 10000 20000 40000] [--window N]
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import main  # noqa: E402
+
+PAGE_SIZE = 20
+OVERLAP = 1  # Instagram repeats the boundary item between neighbouring pages
+
+
+def make_pages(total: int) -> list:
+    """Build newest-first pages of fake items, each overlapping the previous one"""
+    items = [{"item_id": str(10**18 + i), "user_id": 1, "timestamp": 1_700_000_000_000_000 - i,
+              "item_type": "text", "text": f"message {i}"} for i in range(total)]
+    pages = []
+    start = 0
+    while start < total:
+        pages.append(items[max(0, start - OVERLAP):start + PAGE_SIZE])
+        start += PAGE_SIZE
+    return pages
+
+
+def run(total: int, window: int | None) -> float:
+    pages = make_pages(total)
+
+    def fake_get_page(thread_id, cursor="", full=False):
+        index = int(cursor)
+        return {"thread": {"items": pages[index], "has_older": index + 1 < len(pages), "prev_cursor": str(index + 1)}}
+
+    main.CLIENT = main.DMClient("bench")
+    main.CLIENT.get_page = fake_get_page
+    main.OPTIONS.dedup_window = window
+    scrape = main.ThreadScrape("bench", main.OPTIONS)
+
+    started = time.process_time()
+    main.get_all_messages(scrape, {"newest_cursor": "0"})
+    elapsed = time.process_time() - started
+
+    assert len(scrape.messages) == total, f"expected {total} messages, got {len(scrape.messages)}"
+    return elapsed
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--sizes", type=int, nargs="+", default=[10_000, 20_000, 40_000, 80_000, 160_000])
+    parser.add_argument("--window", type=int, default=None, help="Use the bounded dedup index")
+    args = parser.parse_args()
+
+    print(f"{'messages':>10} {'cpu (s)':>10} {'us/msg':>10}")
+    for size in args.sizes:
+        elapsed = run(size, args.window)
+        print(f"{size:>10} {elapsed:>10.3f} {elapsed / size * 1e6:>10.2f}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,119 @@
+"""Throughput benchmark of a full scrape against the local fake API.
+
+Starts benchmarks/fake_api.py in a subprocess (so its CPU and memory are
+not counted), points main.CLIENT at it and runs, per thread:
+
+- get_all_messages: paging through the whole thread over HTTP
+- print_messages: exporting the fetched messages to a file
+
+and reports messages/s, requests, CPU per page and the peak RSS of the
+scraper process. The request rate is not capped unless --rate is given,
+so the numbers show the scraper's own cost, not the pacing.
+
+Usage: python benchmarks/bench_scrape.py [--messages 20000] [--latency 0.005] [--throttle-every 200] [--json]
+"""
+import argparse
+import json
+import os
+import resource
+import subprocess
+import sys
+import tempfile
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import main  # noqa: E402
+
+
+def start_server(args) -> tuple:
+    """Run the fake API in a subprocess, returns (process, base url, thread ids)"""
+    command = [sys.executable, os.path.join(ROOT, "benchmarks", "fake_api.py"), "--port", "0",
+               "--threads", str(args.threads), "--messages", str(args.messages), "--page-size", str(args.page_size),
+               "--latency", str(args.latency), "--throttle", args.throttle,
+               "--throttle-every", str(args.throttle_every)]
+    process = subprocess.Popen(command, stdout=subprocess.PIPE, text=True)
+    port = process.stdout.readline().split()[-1]
+    thread_ids = [process.stdout.readline().split()[1] for _ in range(args.threads)]
+    return process, f"http://127.0.0.1:{port}/api/v1", thread_ids
+
+
+def peak_rss_mb() -> float:
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024  # KiB on Linux
+
+
+def measure(function, *args):
+    """(result, wall seconds, cpu seconds) of one call"""
+    wall, cpu = time.perf_counter(), time.process_time()
+    result = function(*args)
+    return result, time.perf_counter() - wall, time.process_time() - cpu
+
+
+def bench_thread(thread_id: str, output_dir: str) -> dict:
+    requests_before = main.METRICS.requests
+    scrape = main.ThreadScrape(thread_id, main.OPTIONS, os.path.join(output_dir, f"{thread_id}.txt"))
+
+    def fetch():
+        thread = main.begin_scrape(scrape, main.get_page(scrape))
+        return thread is not None and main.get_all_messages(scrape, thread)
+
+    completed, fetch_wall, fetch_cpu = measure(fetch)
+    assert completed, f"thread {thread_id} did not finish"
+    pages = scrape.pages + 1
+    written, print_wall, print_cpu = measure(main.print_messages, scrape)
+
+    return {
+        "thread_id": thread_id,
+        "messages": scrape.count,
+        "requests": main.METRICS.requests - requests_before,
+        "fetch_msg_s": scrape.count / fetch_wall,
+        "fetch_cpu_ms_page": fetch_cpu / pages * 1000,
+        "print_msg_s": written / print_wall,
+        "print_cpu_us_msg": print_cpu / max(1, written) * 1e6,
+        "peak_rss_mb": peak_rss_mb(),
+    }
+
+
+def main_bench():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--threads", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=20_000, help="Messages per thread")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds the fake API adds to every response")
+    parser.add_argument("--throttle", type=str, default="", help="Request numbers the fake API answers with a 429")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with a 429")
+    parser.add_argument("--rate", type=float, default=None, help="Request rate cap (default: uncapped)")
+    parser.add_argument("--json", action="store_true", help="Print the results as JSON")
+    args = parser.parse_args()
+
+    rate = args.rate or 1e9
+    main.ARGS = main.PARSER.parse_args(["-s", "bench", "--rate", str(rate), "--max-rate", str(rate),
+                                        "--burst", "1000000" if args.rate is None else "2",
+                                        "--max-backoff", "1"])
+    main.OPTIONS.checkpoint_every = 0
+    main.SESSIONID = "bench"
+    main.init_client()
+
+    process, main.CLIENT.api_url, thread_ids = start_server(args)
+    try:
+        with tempfile.TemporaryDirectory() as output_dir:
+            results = [bench_thread(thread_id, output_dir) for thread_id in thread_ids]
+    finally:
+        process.terminate()
+        process.wait()
+
+    if args.json:
+        print(json.dumps(results, indent=2))
+        return
+
+    print(f"{'thread':>38} {'messages':>9} {'requests':>9} {'fetch msg/s':>12} {'cpu ms/page':>12} "
+          f"{'print msg/s':>12} {'cpu us/msg':>11} {'peak RSS MB':>12}")
+    for r in results:
+        print(f"{r['thread_id']:>38} {r['messages']:>9} {r['requests']:>9} {r['fetch_msg_s']:>12.0f} "
+              f"{r['fetch_cpu_ms_page']:>12.3f} {r['print_msg_s']:>12.0f} {r['print_cpu_us_msg']:>11.2f} "
+              f"{r['peak_rss_mb']:>12.1f}")
+
+
+if __name__ == "__main__":
+    main_bench()
@@ -0,0 +1,201 @@
+"""Local stand-in for the Instagram DM endpoints the scraper uses.
+
+Serves /api/v1/direct_v2/threads/{id}/, /direct_v2/inbox/ and
+/direct_v2/pending_inbox/ from synthetic, deterministic data:
+
+- every thread has --messages items of mixed types (text, photos, videos,
+  voice, temporary media, post shares, likes), newest first
+- cursors are item ids like Instagram's: a page starts at its cursor item,
+  so neighbouring pages share one boundary item, and each page reports
+  has_older and prev_cursor (the oldest item on it)
+- --latency adds a delay to every response
+- --throttle N,M,... answers those request numbers (1-based) with a 429,
+  --throttle-every N answers every Nth one
+
+Usage: python benchmarks/fake_api.py [--port 8000] [--threads 3] [--messages 5000]
+Prints "listening on <port>" once it accepts requests (useful with --port 0).
+"""
+import argparse
+import json
+import random
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlparse
+
+BASE_THREAD_ID = 340282366841710300949128100000000000
+BASE_ITEM_ID = 31000000000000000000000000000000000
+BASE_TIMESTAMP = 1_700_000_000_000_000  # Microseconds, like the API
+CDN = "https://scontent.cdninstagram.com/v/t51.2885-15"
+
+# (item_type, weight) of the generated items
+ITEM_MIX = (("text", 70), ("photo", 8), ("video", 4), ("voice_media", 5), ("raven_media", 3),
+            ("media_share", 6), ("like", 4))
+
+
+def make_item(rng: random.Random, index: int, timestamp: int, users: list) -> dict:
+    """One synthetic API item, shaped like the real ones for its type"""
+    kind = rng.choices([kind for kind, _ in ITEM_MIX], [weight for _, weight in ITEM_MIX])[0]
+    item = {"item_id": str(BASE_ITEM_ID + index), "user_id": rng.choice(users)["pk"], "timestamp": timestamp,
+            "client_context": str(rng.getrandbits(60))}
+    image = {"image_versions2": {"candidates": [{"url": f"{CDN}/{index}_n.jpg?stp=dst-jpg&_nc_ht=x", "width": 1080,
+                                                 "height": 1350} for _ in range(3)]},
+             "original_width": 1080, "original_height": 1350}
+
+    if kind == "text":
+        item.update(item_type="text", text=" ".join(rng.choice(("hey", "lol", "ok", "see you", "what?", "😂", "tomorrow"))
+                                                    for _ in range(rng.randint(1, 12))))
+    elif kind == "photo":
+        item.update(item_type="media", media={"media_type": 1, **image})
+    elif kind == "video":
+        item.update(item_type="media", media={"media_type": 2, **image,
+                                              "video_versions": [{"url": f"{CDN}/{index}_n.mp4?efg=x", "type": 101}]})
+    elif kind == "voice_media":
+        item.update(item_type="voice_media", voice_media={"media": {"audio": {
+            "audio_src": f"{CDN}/{index}_n.m4a", "duration": rng.randint(1000, 60000),
+            "waveform_data": [rng.random() for _ in range(20)]}}})
+    elif kind == "raven_media":
+        item.update(item_type="raven_media", visual_media={"media": {"media_type": 1, **image}, "seen_count": 1})
+    elif kind == "media_share":
+        item.update(item_type="media_share", media_share={"code": f"C{index:09d}", "media_type": 1, **image,
+                                                          "user": {"username": "someone", "full_name": "Some One"}})
+    else:
+        item.update(item_type="like", like="❤️")
+    return item
+
+
+class FakeInstagram:
+    """The synthetic account: threads, their items and the request counters"""
+
+    def __init__(self, threads: int = 3, messages: int = 5000, page_size: int = 20, inbox_page_size: int = 20,
+                 latency: float = 0.0, throttle: set | None = None, throttle_every: int = 0, seed: int = 0):
+        self.page_size = page_size
+        self.inbox_page_size = inbox_page_size
+        self.latency = latency
+        self.throttle = throttle or set()
+        self.throttle_every = throttle_every
+        self.requests = 0
+        self.throttled = 0
+        self._lock = threading.Lock()
+
+        rng = random.Random(seed)
+        self.threads: dict = {}
+        self.index: dict = {}  # thread_id: {item_id: position}
+        for number in range(threads):
+            thread_id = str(BASE_THREAD_ID + number)
+            users = [{"pk": 1000 + number * 10 + k, "username": f"user{number}_{k}", "full_name": f"User{number} {k}"}
+                     for k in range(1 + (number % 3))]
+            items = [make_item(rng, number * messages + i, BASE_TIMESTAMP - i * 37_000_000, users)
+                     for i in range(messages)]
+            self.threads[thread_id] = {"users": users, "items": items, "is_group": len(users) > 1,
+                                       "thread_title": f"Group {number}" if len(users) > 1 else ""}
+            self.index[thread_id] = {item["item_id"]: i for i, item in enumerate(items)}
+
+    def count_request(self) -> bool:
+        """Count a request, returns True if it should be answered with a 429"""
+        with self._lock:
+            self.requests += 1
+            throttled = self.requests in self.throttle or (self.throttle_every and self.requests % self.throttle_every == 0)
+            if throttled:
+                self.throttled += 1
+            return bool(throttled)
+
+    def thread_page(self, thread_id: str, cursor: str) -> dict | None:
+        thread = self.threads.get(thread_id)
+        if thread is None:
+            return None
+        items = thread["items"]
+        start = self.index[thread_id].get(cursor, 0) if cursor else 0
+        page = items[start:start + self.page_size]
+        has_older = start + self.page_size < len(items)
+        return {"thread": {
+            "thread_id": thread_id, "users": thread["users"], "is_group": thread["is_group"],
+            "thread_title": thread["thread_title"], "items": page, "has_older": has_older, "has_newer": start > 0,
+            "prev_cursor": page[-1]["item_id"] if page else None,
+            "oldest_cursor": page[-1]["item_id"] if page else None,
+            "newest_cursor": items[0]["item_id"] if items else None,
+        }, "status": "ok"}
+
+    def inbox_page(self, cursor: str, pending: bool) -> dict:
+        thread_ids = [] if pending else list(self.threads)
+        start = int(cursor) if cursor else 0
+        page = thread_ids[start:start + self.inbox_page_size]
+        threads = [{"thread_id": thread_id, "users": self.threads[thread_id]["users"],
+                    "is_group": self.threads[thread_id]["is_group"],
+                    "thread_title": self.threads[thread_id]["thread_title"],
+                    "last_activity_at": self.threads[thread_id]["items"][0]["timestamp"]} for thread_id in page]
+        has_older = start + self.inbox_page_size < len(thread_ids)
+        return {"inbox": {"threads": threads, "has_older": has_older,
+                          "oldest_cursor": str(start + self.inbox_page_size) if has_older else None},
+                "status": "ok"}
+
+
+def make_handler(api: FakeInstagram):
+    class Handler(BaseHTTPRequestHandler):
+        protocol_version = "HTTP/1.1"
+        disable_nagle_algorithm = True  # Headers and body are separate writes, don't let them wait for an ACK
+
+        def log_message(self, *args):
+            pass
+
+        def send_json(self, status: int, body: dict, extra_headers: dict | None = None):
+            data = json.dumps(body).encode()
+            self.send_response(status)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            for name, value in (extra_headers or {}).items():
+                self.send_header(name, value)
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_GET(self):
+            if api.latency:
+                time.sleep(api.latency)
+            if api.count_request():
+                self.send_json(429, {"message": "Please wait a few minutes before you try again.", "status": "fail"},
+                               {"Retry-After": "0"})
+                return
+
+            url = urlparse(self.path)
+            cursor = parse_qs(url.query).get("cursor", [""])[0]
+            parts = [part for part in url.path.split("/") if part]
+            if parts[-1] in ("inbox", "pending_inbox"):
+                self.send_json(200, api.inbox_page(cursor, parts[-1] == "pending_inbox"))
+                return
+            if len(parts) >= 2 and parts[-2] == "threads":
+                body = api.thread_page(parts[-1], cursor)
+                if body is not None:
+                    self.send_json(200, body)
+                    return
+            self.send_json(404, {"message": "Page not found", "status": "fail"})
+
+    return Handler
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--port", type=int, default=8000)
+    parser.add_argument("--threads", type=int, default=3)
+    parser.add_argument("--messages", type=int, default=5000, help="Items per thread")
+    parser.add_argument("--page-size", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.0, help="Seconds added to every response")
+    parser.add_argument("--throttle", type=str, default="", help="Request numbers to answer with a 429, e.g. 5,6,40")
+    parser.add_argument("--throttle-every", type=int, default=0, help="Answer every Nth request with a 429")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args()
+
+    api = FakeInstagram(args.threads, args.messages, args.page_size, latency=args.latency,
+                        throttle={int(n) for n in args.throttle.split(",") if n},
+                        throttle_every=args.throttle_every, seed=args.seed)
+    server = ThreadingHTTPServer(("127.0.0.1", args.port), make_handler(api))
+    print(f"listening on {server.server_address[1]}", flush=True)
+    for thread_id in api.threads:
+        print(f"thread {thread_id} ({args.messages} messages)", flush=True)
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,109 @@
+import json
+import os
+import time
+
+DEFAULT_CHECKPOINT_DIR = "checkpoints"
+DEFAULT_CHECKPOINT_EVERY = 10
+RECENT_CURSORS = 10  # Cursors of the last pages kept in the state file
+
+
+def atomic_write(path: str, data: str):
+    """Write a file so that readers only ever see the old or the new version"""
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="UTF-8") as f:
+        f.write(data)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+class Checkpoint:
+    """On-disk progress of one thread's pagination run.
+
+    Items are appended to a JSONL file as they are fetched; a small state
+    file (written atomically, after the items are synced) records the next
+    cursor to fetch, how many pages led there (with the cursors of the last
+    RECENT_CURSORS of them) and how many bytes of the items file are valid.
+    Anything past that offset is from an interrupted write and is dropped on
+    resume. The directory is only created once there is something to save
+    and removed again, when empty, by clear().
+    """
+
+    def __init__(self, directory: str, thread_id: str):
+        self.directory = directory
+        self.state_path = os.path.join(directory, f"{thread_id}.json")
+        self.items_path = os.path.join(directory, f"{thread_id}.items.jsonl")
+        self.thread_id = thread_id
+        self.count = 0  # Items covered by the state file
+        self.offset = 0
+        self._file = None
+        self._pending = 0
+
+    def exists(self) -> bool:
+        return os.path.isfile(self.state_path)
+
+    def load(self):
+        """Returns (item count, page count, recent cursors, next cursor) of the last good checkpoint"""
+        with open(self.state_path, encoding="UTF-8") as f:
+            state = json.load(f)
+        self.offset = state["offset"]
+        self.count = state["messages"]
+        return self.count, state.get("pages", len(state["cursors"])), state["cursors"], state["next_cursor"]
+
+    def iter_items(self):
+        """Items (as dicts) of the last good checkpoint, newest first, read lazily"""
+        with open(self.items_path, "rb") as f:
+            remaining = self.offset
+            for line in f:
+                remaining -= len(line)
+                if remaining < 0:
+                    break
+                yield json.loads(line)
+
+    def add(self, items: list):
+        """Append fetched MessageRecords, they become part of the checkpoint on the next save()"""
+        if self._file is None:
+            if not self.offset and self.exists():
+                os.remove(self.state_path)  # Leftover of an earlier run that is being overwritten
+            os.makedirs(self.directory, exist_ok=True)
+            self._file = open(self.items_path, "ab" if self.offset else "wb")
+            self._file.truncate(self.offset)
+        for item in items:
+            self._file.write(json.dumps(item.to_dict()).encode("UTF-8") + b"\n")
+        self._pending += len(items)
+
+    def save(self, pages: int, cursors, next_cursor: str | None):
+        """Sync the added items and record the new position, after pages pages ending with cursors"""
+        if self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self.offset = self._file.tell()
+        self.count += self._pending
+        self._pending = 0
+
+        os.makedirs(self.directory, exist_ok=True)
+        atomic_write(self.state_path, json.dumps({
+            "thread_id": self.thread_id,
+            "pages": pages,
+            "cursors": list(cursors)[-RECENT_CURSORS:],
+            "next_cursor": next_cursor,
+            "offset": self.offset,
+            "messages": self.count,
+            "updated_at": int(time.time()),
+        }))
+
+    def clear(self):
+        """Remove the checkpoint once the run finished"""
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+        for path in (self.state_path, self.items_path):
+            if os.path.exists(path):
+                os.remove(path)
+        try:
+            os.rmdir(self.directory)
+        except OSError:  # Missing, or still holds other chats' checkpoints
+            pass
+        self.count = 0
+        self.offset = 0
+        self._pending = 0
@@ -0,0 +1,75 @@
+import threading
+
+from shared_db import connect_shared
+
+DEFAULT_CURSOR_INDEX = "cursor_index.db"
+FLUSH_EVERY = 100  # Pages buffered before they are written
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    thread_id TEXT NOT NULL,
+    cursor TEXT NOT NULL,
+    newest INTEGER NOT NULL,
+    oldest INTEGER NOT NULL,
+    PRIMARY KEY (thread_id, cursor)
+);
+CREATE INDEX IF NOT EXISTS pages_by_time ON pages (thread_id, newest);
+"""
+
+
+class CursorIndex:
+    """Persisted (cursor, newest timestamp, oldest timestamp) of every fetched page.
+
+    Filled while chats are scraped, so a later run with --until can start
+    paging at the page that holds the end of its window instead of at the
+    newest message. Timestamps are the API's microseconds. Pages are
+    buffered and written FLUSH_EVERY at a time. The file is only opened
+    once a page is written or looked up, runs that record nothing never
+    touch it.
+    """
+
+    def __init__(self, path: str = DEFAULT_CURSOR_INDEX):
+        self.path = path
+        self.conn = None
+        self._lock = threading.Lock()
+        self._pending: list = []
+
+    def _connect(self):
+        if self.conn is None:
+            self.conn = connect_shared(self.path, SCHEMA)
+        return self.conn
+
+    def add(self, thread_id: str, cursor: str, items: list):
+        """Remember the timestamp range of the page fetched at cursor (raw API items, newest first)"""
+        if not cursor or not items:
+            return
+        with self._lock:
+            self._pending.append((thread_id, cursor, int(items[0]["timestamp"]), int(items[-1]["timestamp"])))
+            if len(self._pending) >= FLUSH_EVERY:
+                self._flush()
+
+    def seek(self, thread_id: str, until: int):
+        """(cursor, newest timestamp) of the newest-starting page that still has everything up to until, or None"""
+        with self._lock:
+            self._flush()
+            return self._connect().execute(
+                "SELECT cursor, newest FROM pages WHERE thread_id = ? AND newest >= ? ORDER BY newest LIMIT 1",
+                (thread_id, until),
+            ).fetchone()
+
+    def flush(self):
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        if not self._pending:
+            return
+        with self._connect() as conn:
+            conn.executemany(
+                "INSERT OR REPLACE INTO pages (thread_id, cursor, newest, oldest) VALUES (?, ?, ?, ?)", self._pending)
+        self._pending = []
+
+    def close(self):
+        self.flush()
+        if self.conn is not None:
+            self.conn.close()
@@ -0,0 +1,120 @@
+import json
+from typing import TypedDict
+
+try:
+    import msgspec
+except ImportError:  # Optional, speeds up thread pages
+    msgspec = None
+
+try:
+    import orjson
+except ImportError:  # Optional, speeds up every other response
+    orjson = None
+
+
+# The parts of a thread page the scraper reads. msgspec decodes straight into
+# plain dicts shaped like these and skips everything else (image sizes,
+# waveforms, reactions, ...) without building objects for it.
+class Candidate(TypedDict, total=False):
+    url: str
+
+
+class ImageVersions(TypedDict, total=False):
+    candidates: list[Candidate]
+
+
+class VideoVersion(TypedDict, total=False):
+    url: str
+
+
+class Media(TypedDict, total=False):
+    media_type: int
+    image_versions2: ImageVersions
+    video_versions: list[VideoVersion]
+
+
+class ShareUser(TypedDict, total=False):
+    username: str
+    full_name: str
+
+
+class MediaShare(TypedDict, total=False):
+    code: str
+    user: ShareUser
+
+
+class Audio(TypedDict, total=False):
+    audio_src: str
+
+
+class VoiceMediaInner(TypedDict, total=False):
+    audio: Audio
+
+
+class VoiceMedia(TypedDict, total=False):
+    media: VoiceMediaInner
+
+
+class VisualMedia(TypedDict, total=False):
+    media: Media
+
+
+class Item(TypedDict, total=False):
+    item_id: str
+    user_id: int | str
+    timestamp: int | str
+    item_type: str
+    text: str | None
+    media: Media
+    media_share: MediaShare
+    voice_media: VoiceMedia
+    visual_media: VisualMedia
+
+
+class User(TypedDict, total=False):
+    pk: int | str
+    full_name: str
+
+
+class Thread(TypedDict, total=False):
+    thread_id: str
+    users: list[User]
+    items: list[Item]
+    has_older: bool
+    prev_cursor: str | None
+    oldest_cursor: str | None
+    newest_cursor: str | None
+
+
+class ThreadPage(TypedDict, total=False):
+    thread: Thread
+    message: str
+    status: str
+
+
+_thread_page_decoder = msgspec.json.Decoder(ThreadPage) if msgspec is not None else None
+
+
+def decode_json(body: bytes):
+    """Decode a whole JSON response, with orjson when it is installed"""
+    if orjson is not None:
+        return orjson.loads(body)
+    return json.loads(body)
+
+
+def decode_thread_page(body: bytes):
+    """Decode a thread page, keeping only the fields in ThreadPage when msgspec is installed.
+
+    A page that doesn't fit the schema (Instagram changed a type) is decoded
+    in full instead, so it is never lost.
+    """
+    if _thread_page_decoder is not None:
+        try:
+            return _thread_page_decoder.decode(body)
+        except msgspec.ValidationError:
+            pass
+    return decode_json(body)
+
+
+# What the JSON decoders raise on a broken body
+DECODE_ERRORS = (ValueError, UnicodeDecodeError) + ((msgspec.DecodeError,) if msgspec is not None else ())
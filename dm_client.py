@@ -0,0 +1,566 @@
+import asyncio
+import threading
+import time
+from collections import deque
+from datetime import datetime
+
+import requests
+
+from decoding import DECODE_ERRORS, decode_json, decode_thread_page
+from http_client import HTTPClient, aiohttp
+from metrics import Metrics
+from page_cache import PageCache
+from rate_governor import RateGovernor, parse_retry_after
+from records import MessageRecord
+
+DEFAULT_API_URL = "https://www.instagram.com/api/v1"
+DEFAULT_DEDUP_WINDOW = 1000  # Item ids iter_messages remembers; pages only overlap with their neighbours
+REVALIDATE_STATUSES = (401, 403)  # Answers that can mean the API url or headers stopped working, not a bad thread id
+STOP_REASONS = ("since", "stored")  # check_item() reasons that end the paging
+
+# Working headers based on diagnostic test
+HEADERS = {
+    "accept": "*/*",
+    "accept-language": "en-US,en;q=0.9",
+    "referer": "https://www.instagram.com/",
+    "sec-fetch-dest": "empty",
+    "sec-fetch-mode": "cors",
+    "sec-fetch-site": "same-origin",
+    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
+    "x-asbd-id": "129477",
+    "x-ig-app-id": "936619743392459",
+    "x-ig-www-claim": "0",
+    "x-requested-with": "XMLHttpRequest",
+}
+
+
+class RateLimited(RuntimeError):
+    """Instagram kept answering 429 after every retry"""
+
+    def __init__(self):
+        super().__init__("You're being rate-limited (HTTP 429)")
+
+
+class RequestFailed(RuntimeError):
+    """A page could not be fetched, raised by the iter_* methods.
+
+    cursor is the page that failed and response what came back instead of
+    a thread page (None when the request itself failed).
+    """
+
+    def __init__(self, message: str, cursor: str | None = None, response: dict | None = None):
+        super().__init__(message)
+        self.cursor = cursor
+        self.response = response
+
+
+class SeenIndex:
+    """Hash index of already fetched item ids, so duplicate checks are O(1).
+
+    With maxlen set it only remembers the most recent maxlen ids and stores
+    them as ints when possible. Cursor pages only overlap with their direct
+    neighbours, so a window of a few pages is enough to catch every duplicate.
+    """
+
+    def __init__(self, maxlen: int | None = None):
+        self.maxlen = maxlen
+        self._ids: set = set()
+        self._order: deque | None = deque() if maxlen else None
+
+    def _key(self, item_id):
+        if self._order is not None and isinstance(item_id, str) and item_id.isdigit():
+            return int(item_id)
+        return item_id
+
+    def __contains__(self, item_id) -> bool:
+        return self._key(item_id) in self._ids
+
+    def __len__(self) -> int:
+        return len(self._ids)
+
+    def add(self, item_id) -> bool:
+        """Add an id, returns False if it was already indexed"""
+        key = self._key(item_id)
+        if key in self._ids:
+            return False
+        self._ids.add(key)
+        if self._order is not None:
+            self._order.append(key)
+            if len(self._order) > self.maxlen:
+                self._ids.discard(self._order.popleft())
+        return True
+
+    def clear(self):
+        self._ids.clear()
+        if self._order is not None:
+            self._order.clear()
+
+
+def has_prev_cursor(response: dict):
+    """Check if there's a Cursor older than the page in the given response"""
+    return bool(response.get("thread", {}).get("has_older", False))
+
+
+def get_prev_cursor(response: dict):
+    """Get the most recent cursor older than the page in the given response"""
+    thread = response.get("thread", {})
+    return thread.get("prev_cursor") or thread.get("oldest_cursor")
+
+
+def next_page_cursor(response: dict, last_page=None):
+    """The cursor to page on to after a thread response, None if paging ends with it.
+
+    Paging ends on an empty page, the oldest page, or a page whose items
+    last_page(items) says reach far enough back.
+    """
+    items = response["thread"].get("items", [])
+    if not items or (last_page is not None and last_page(items)) or not has_prev_cursor(response):
+        return None
+    return get_prev_cursor(response)
+
+
+def check_item(item: dict, since: int | None = None, until: int | None = None, stored: tuple | None = None):
+    """Why a page item is not kept, None if it is.
+
+    "since": older than since, "stored": reached stored, the (item_id,
+    timestamp) of the newest message the caller already has (both end the
+    paging, see STOP_REASONS); "until": newer than until, only skipped.
+    since and until are microseconds, like the item timestamps.
+    """
+    timestamp = int(item["timestamp"])
+    if since is not None and timestamp < since:
+        return "since"
+    if until is not None and timestamp > until:
+        return "until"
+    if stored is not None and (item["item_id"] == stored[0] or timestamp <= stored[1]):
+        return "stored"
+    return None
+
+
+def reaches_end(items: list, since: int | None = None, stored: tuple | None = None) -> bool:
+    """Whether paging stops on these items (see check_item), so no older page is needed"""
+    if since is None and stored is None:
+        return False
+    return any(check_item(item, since, None, stored) in STOP_REASONS for item in items)
+
+
+def thread_entry(thread: dict, pending: bool):
+    """The part of an inbox thread that is kept in the thread index"""
+    users = thread.get("users", [])
+    if thread.get("is_group"):
+        # For group chats, use the thread title
+        title = thread.get("thread_title", "Unknown Group")
+    elif users:
+        # For 1-on-1 chats, use the first user's full name. The user object in a deleted
+        # account thread will likely have '__deleted__' in the full_name or username.
+        title = users[0].get("full_name", "Unknown")
+    else:
+        title = "Unknown (No User Info)"
+
+    # The newest messages the inbox shows of the chat, for inbox_snapshot's change detection
+    items = thread.get("items") or []
+    newest = items[0] if items else thread.get("last_permanent_item") or {}
+    return {
+        "thread_id": thread["thread_id"],
+        "title": title,
+        "users": [user.get("username", "") for user in users],
+        "last_activity_at": int(thread.get("last_activity_at", 0)),
+        "newest_item_id": newest.get("item_id"),
+        "recent": [int(item["timestamp"]) for item in items if "timestamp" in item],
+        "pending": pending,
+    }
+
+
+def preview(body: bytes) -> str:
+    """First 500 characters of a response body, for error messages"""
+    return body[:500].decode("UTF-8", errors="replace")
+
+
+def quiet(text: str, color: str | None = None):
+    pass
+
+
+class DMClient:
+    """Instagram DM API client that keeps all of its state on the instance.
+
+    Holds the pooled HTTPClient, a RateGovernor and Metrics. Nothing in here
+    belongs to a single scrape, so one client can be shared by a thread
+    pool, and clients for different accounts can run side by side in one
+    process. Status and error lines go to `log(text, color)`, which is
+    silent by default. With a PageCache, get_page() answers from it when it
+    can, except for the newest page (cursor ""), which is always fetched
+    so new messages show up; offline, it never touches the network and the
+    newest page comes from the cache too. When Instagram starts
+    rejecting requests, `revalidate()` is asked (once) for a working
+    (api_url, headers) configuration to switch to. The *_async methods
+    are the same requests on an aiohttp session, for the asyncio engine.
+
+        client = DMClient(sessionid)
+        for message in client.iter_messages(thread_id, since=datetime(2024, 1, 1)):
+            ...
+    """
+
+    def __init__(self, session: HTTPClient | str, governor: RateGovernor | None = None,
+                 metrics: Metrics | None = None, api_url: str = DEFAULT_API_URL, verbose: bool = False, log=quiet,
+                 cache: PageCache | None = None, offline: bool = False, revalidate=None):
+        self.http = HTTPClient(session, HEADERS) if isinstance(session, str) else session
+        self.governor = governor or RateGovernor()
+        self.metrics = metrics or Metrics()
+        self.api_url = api_url
+        self.verbose = verbose
+        self.log = log
+        self.cache = cache
+        self.offline = offline
+        self.revalidate = revalidate
+        self.config_version = 0  # Bumped by every switch of api_url or headers
+        self._revalidated = False
+        self._config_lock = threading.Lock()
+
+    def close(self):
+        self.http.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def thread_url(self, thread_id: str, cursor: str = ""):
+        return f"{self.api_url}/direct_v2/threads/{thread_id}/?cursor={cursor}"
+
+    def inbox_url(self, cursor: str = "", pending: bool = False):
+        folder = "pending_inbox" if pending else "inbox"
+        return f"{self.api_url}/direct_v2/{folder}/?persistentBadging=true&folder=&limit=200&cursor={cursor}"
+
+    def get(self, url: str, thread_id: str | None = None, full: bool = False):
+        """GET url and decode its JSON, None if the request failed.
+
+        A request with a thread_id is a thread page and is decoded with
+        decode_thread_page(), which only keeps the fields the scraper reads,
+        unless full is set (--keep-raw needs the whole items).
+        """
+        fetched = self.fetch(url, thread_id)
+        if fetched is None:
+            return None
+        return self.decode(*fetched, thread_id is not None and not full)
+
+    def get_page(self, thread_id: str, cursor: str = "", full: bool = False):
+        """get() a thread page, from the page cache if it has it (and then into it)"""
+        response = self.cached_page(thread_id, cursor, full)
+        if response is not None or self.offline:
+            return response
+        fetched = self.fetch(self.thread_url(thread_id, cursor), thread_id)
+        if fetched is None:
+            return None
+        return self.page_response(thread_id, cursor, *fetched, full)
+
+    def cached_page(self, thread_id: str, cursor: str, full: bool = False):
+        """The decoded page from the page cache, None if it isn't there.
+
+        The newest page is only read from the cache offline: it changes with
+        every new message, so online it would hide them for the whole TTL.
+        It is still written to the cache, for --offline replays.
+        """
+        if self.cache is None or (not cursor and not self.offline):
+            return None
+        body = self.cache.get(thread_id, cursor, any_age=self.offline)
+        if body is None:
+            if self.offline:
+                self.log(f"Error: Page {cursor or '(newest)'} of thread {thread_id} is not in the page cache", "red")
+            return None
+        self.metrics.cache_hit()
+        return self.decode(200, "OK", body, not full)
+
+    def page_response(self, thread_id: str, cursor: str, status_code: int, reason: str, body: bytes, full: bool = False):
+        """decode() a fetched thread page and keep it in the page cache"""
+        response = self.decode(status_code, reason, body, not full)
+        if self.cache is not None and response is not None and "thread" in response:
+            self.cache.put(thread_id, cursor, body)
+        return response
+
+    def fetch(self, url: str, thread_id: str | None = None):
+        """GET url, returns (status code, reason, body) or None if the request failed.
+
+        Requests are paced by the governor. Timeouts, 429s and 5xx responses
+        are retried (same URL, so the same cursor) with exponential backoff,
+        honouring Retry-After when Instagram sends it. Raises RateLimited if
+        the 429s outlast the retries.
+        """
+        if self.offline:
+            self.log(f"Error: Offline, not requesting {url}", "red")
+            return None
+        version, api_url = self.config_version, self.api_url
+        for attempt in range(self.governor.max_retries + 1):
+            self.governor.acquire()
+
+            started = time.perf_counter()
+            try:
+                r = self.http.get(url)
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError) as e:
+                wait = self.connection_failed(attempt, isinstance(e, requests.exceptions.Timeout))
+                if wait is None:
+                    return None
+                time.sleep(wait)
+                continue
+            except Exception as e:
+                self.log(f"Error: {str(e)}", "red")
+                return None
+
+            wait = self.request_done(url, thread_id, attempt, r.status_code, r.headers.get("Retry-After"),
+                                     time.perf_counter() - started, len(r.content))
+            if wait is not None:
+                time.sleep(wait)
+                continue
+
+            retry_url = self.rejected(url, r.status_code, version, api_url)
+            if retry_url is not None:
+                return self.fetch(retry_url, thread_id)
+            return r.status_code, r.reason, r.content
+
+        return None
+
+    def rejected(self, url: str, status_code: int, version: int, api_url: str):
+        """Where to retry a request Instagram rejected, once revalidate() found a working configuration, or None.
+
+        revalidate() runs once per client; requests rejected while it runs
+        wait for it and are retried with its result too. Nothing is retried
+        when the configuration is still the one the request was made with.
+        """
+        if self.revalidate is None or status_code not in REVALIDATE_STATUSES:
+            return None
+        with self._config_lock:
+            if not self._revalidated:
+                self._revalidated = True
+                config = self.revalidate()
+                if config is not None:
+                    self.use_config(*config)
+        if self.config_version == version:
+            return None
+        return self.api_url + url.removeprefix(api_url) if url.startswith(api_url) else url
+
+    def use_config(self, api_url: str, headers: dict):
+        """Switch to another API url and header set"""
+        if api_url == self.api_url and headers == self.http.headers:
+            return
+        self.api_url = api_url
+        self.http.set_headers(headers)
+        self.config_version += 1
+
+    async def fetch_async(self, session, url: str, thread_id: str | None = None):
+        """fetch() on an aiohttp session (see http_client.open_async_session).
+
+        The session's headers are fixed, so rejected requests are not
+        revalidated.
+        """
+        if self.offline:
+            self.log(f"Error: Offline, not requesting {url}", "red")
+            return None
+        for attempt in range(self.governor.max_retries + 1):
+            await self.governor.acquire_async()
+
+            started = time.perf_counter()
+            try:
+                async with session.get(url) as r:
+                    body = await r.read()
+                    status_code, reason, retry_after = r.status, r.reason, r.headers.get("Retry-After")
+            except (asyncio.TimeoutError, aiohttp.ClientError) as e:
+                wait = self.connection_failed(attempt, isinstance(e, asyncio.TimeoutError))
+                if wait is None:
+                    return None
+                await asyncio.sleep(wait)
+                continue
+
+            wait = self.request_done(url, thread_id, attempt, status_code, retry_after,
+                                     time.perf_counter() - started, len(body))
+            if wait is not None:
+                await asyncio.sleep(wait)
+                continue
+            return status_code, reason, body
+
+        return None
+
+    async def get_async(self, session, url: str, thread_id: str | None = None, full: bool = False):
+        """get() on an aiohttp session"""
+        fetched = await self.fetch_async(session, url, thread_id)
+        if fetched is None:
+            return None
+        return self.decode(*fetched, thread_id is not None and not full)
+
+    async def get_page_async(self, session, thread_id: str, cursor: str = "", full: bool = False):
+        """get_page() on an aiohttp session, the page cache is read and written on a worker thread"""
+        response = await asyncio.to_thread(self.cached_page, thread_id, cursor, full)
+        if response is not None or self.offline:
+            return response
+        fetched = await self.fetch_async(session, self.thread_url(thread_id, cursor), thread_id)
+        if fetched is None:
+            return None
+        return await asyncio.to_thread(self.page_response, thread_id, cursor, *fetched, full)
+
+    def connection_failed(self, attempt: int, timed_out: bool):
+        """Seconds to wait before retrying a request that got no response, None to give up"""
+        if attempt < self.governor.max_retries:
+            wait = self.governor.backoff(attempt)
+            self.metrics.retry("timeout" if timed_out else "connection")
+            reason = "Request timed out" if timed_out else "Connection failed"
+            self.log(f"\n[!] {reason}, retrying in {wait:.1f}s ({attempt + 1}/{self.governor.max_retries})", "yellow")
+            return wait
+        if timed_out:
+            self.log("Error: Request timed out", "red")
+        else:
+            self.log("Error: Connection failed. Check your internet.", "red")
+        return None
+
+    def request_done(self, url: str, thread_id: str | None, attempt: int, status_code: int, retry_after: str | None,
+                     seconds: float, size: int):
+        """Count a finished request and feed its status to the governor.
+
+        Returns the seconds to wait before retrying it, or None if the response
+        should be handled as is.
+        """
+        self.metrics.request(seconds, status_code, size, thread_id)
+
+        if self.verbose:
+            self.log(f"[DEBUG] Request to: {url}", "cyan")
+            self.log(f"[DEBUG] Status Code: {status_code}", "cyan")
+
+        if status_code != 429 and status_code < 500:
+            self.governor.on_success()
+            return None
+
+        self.governor.on_throttle()
+        if attempt < self.governor.max_retries:
+            wait = self.governor.backoff(attempt, parse_retry_after(retry_after))
+            self.metrics.retry("rate_limited" if status_code == 429 else "server_error")
+            self.log(f"\n[!] HTTP {status_code}, slowing down to {self.governor.rate:.2f} req/s "
+                     f"and retrying in {wait:.1f}s ({attempt + 1}/{self.governor.max_retries})", "yellow")
+            return wait
+        if status_code == 429:
+            raise RateLimited()
+        return None
+
+    def decode(self, status_code: int, reason: str, body: bytes, thread_page: bool = False):
+        """Check the status code of a finished request and decode its JSON"""
+        if status_code == 400:
+            self.log(f"\nError: HTTP 400 - Bad Request", "red")
+            self.log("Possible causes:", "yellow")
+            self.log("  1. Invalid Thread ID format", "yellow")
+            self.log("  2. Session ID has incorrect format or expired", "yellow")
+            self.log("  3. Instagram has updated their API requirements", "yellow")
+            if self.verbose:
+                self.log(f"\nResponse: {preview(body)}", "cyan")
+            return None
+        elif status_code == 401:
+            self.log(f"\nError: HTTP 401 - Unauthorized", "red")
+            self.log("Your session ID is invalid or expired. Get a new one!", "yellow")
+            return None
+        elif status_code != 200:
+            self.log(f"\nError: HTTP {status_code} - {reason}", "red")
+            if self.verbose:
+                self.log(f"Response: {preview(body)}", "cyan")
+            return None
+
+        try:
+            started = time.perf_counter()
+            res = decode_thread_page(body) if thread_page else decode_json(body)
+            self.metrics.decoded(time.perf_counter() - started)
+        except DECODE_ERRORS:
+            self.log("Error: Invalid JSON response", "red")
+            if self.verbose:
+                self.log(f"Response text: {preview(body)}", "cyan")
+            return None
+
+        if self.verbose:
+            self.log(f"[DEBUG] Response keys: {list(res.keys())}", "cyan")
+
+        return res
+
+    def inbox_page(self, r: dict | None, pending: bool):
+        """Turn one inbox response into (thread entries, cursor of the next page or None), None on error"""
+        if r is None:
+            return None
+
+        if "inbox" not in r:
+            self.log("\nError: Could not fetch inbox", "red")
+            if "message" in r:
+                self.log(f"Instagram says: {r['message']}", "yellow")
+            return None
+
+        entries = []
+        for thread in r["inbox"]["threads"]:
+            entry = thread_entry(thread, pending)
+            if "__deleted__" not in entry["title"]:
+                entries.append(entry)
+            else:
+                self.log(f"[INFO] Omitting deleted thread: {entry['title']} [{entry['thread_id']}]", "yellow")
+
+        cursor = r["inbox"].get("oldest_cursor")
+        return entries, (cursor if r["inbox"].get("has_older") and cursor else None)
+
+    def iter_threads(self):
+        """Yield the index entry of every chat, page by page: the inbox, then the pending folder"""
+        for pending in (False, True):
+            cursor = ""
+            while cursor is not None:
+                page = self.inbox_page(self.get(self.inbox_url(cursor, pending)), pending)
+                if page is None:
+                    raise RequestFailed("The inbox could not be read to the end")
+                entries, cursor = page
+                yield from entries
+
+    async def iter_threads_async(self, session):
+        """iter_threads() on an aiohttp session"""
+        for pending in (False, True):
+            cursor = ""
+            while cursor is not None:
+                page = self.inbox_page(await self.get_async(session, self.inbox_url(cursor, pending)), pending)
+                if page is None:
+                    raise RequestFailed("The inbox could not be read to the end")
+                entries, cursor = page
+                for entry in entries:
+                    yield entry
+
+    def iter_pages(self, thread_id: str, cursor: str | None = "", full: bool = False, last_page=None):
+        """Yield (cursor, thread response) of a chat's pages from cursor ("" is the newest page) towards the oldest.
+
+        last_page(items) tells when the items of a page reach far enough
+        back (see next_page_cursor). Only the fields in decoding.ThreadPage
+        are kept unless full is set. Raises RequestFailed on a page that
+        could not be fetched.
+        """
+        while cursor is not None:
+            response = self.get_page(thread_id, cursor, full)
+            if response is None or "thread" not in response:
+                raise RequestFailed(f"Could not fetch thread {thread_id} at cursor {cursor!r}", cursor, response)
+            yield cursor, response
+            cursor = next_page_cursor(response, last_page)
+
+    async def iter_pages_async(self, session, thread_id: str, cursor: str | None = "", full: bool = False,
+                               last_page=None):
+        """iter_pages() on an aiohttp session"""
+        while cursor is not None:
+            response = await self.get_page_async(session, thread_id, cursor, full)
+            if response is None or "thread" not in response:
+                raise RequestFailed(f"Could not fetch thread {thread_id} at cursor {cursor!r}", cursor, response)
+            yield cursor, response
+            cursor = next_page_cursor(response, last_page)
+
+    def iter_messages(self, thread_id: str, since: datetime | None = None, until: datetime | None = None,
+                      keep_raw: bool = False, stored: tuple | None = None):
+        """Yield a chat's MessageRecords newest first, from `until` back to `since` (the whole chat if both are None).
+
+        Paging also stops at `stored`, the (item_id, timestamp) of the newest
+        message the caller already has (see check_item). Duplicates from
+        overlapping pages are dropped with a bounded SeenIndex, so memory
+        stays flat however long the chat is.
+        """
+        lower = int(since.timestamp() * 1000000) if since is not None else None
+        upper = int(until.timestamp() * 1000000) if until is not None else None
+        seen = SeenIndex(DEFAULT_DEDUP_WINDOW)
+        pages = self.iter_pages(thread_id, full=keep_raw, last_page=lambda items: reaches_end(items, lower, stored))
+        for _, response in pages:
+            for item in response["thread"].get("items", []):
+                reason = check_item(item, lower, upper, stored)
+                if reason in STOP_REASONS:
+                    return
+                if reason is None and seen.add(item["item_id"]):
+                    yield MessageRecord.from_item(item, keep_raw)
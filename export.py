@@ -0,0 +1,175 @@
+import csv
+import io
+import json
+import os
+import sqlite3
+from array import array
+
+from archive import ArchiveExport
+
+COPY_CHUNK = 1024 * 1024
+
+# Normalized fields of the structured formats, timestamp in microseconds since the epoch
+EXPORT_FIELDS = ("item_id", "thread_id", "sender_id", "sender", "type", "text", "url", "timestamp")
+EXPORT_FORMATS = {"text": "txt", "jsonl": "jsonl", "csv": "csv", "sqlite": "db", "archive": "archive"}  # --format: file extension
+
+SQLITE_SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    item_id TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    sender_id INTEGER,
+    sender TEXT,
+    type TEXT,
+    text TEXT,
+    url TEXT,
+    timestamp INTEGER NOT NULL,
+    PRIMARY KEY (thread_id, item_id)
+);
+"""
+
+
+def jsonl_line(row: tuple) -> str:
+    return json.dumps(dict(zip(EXPORT_FIELDS, row)), ensure_ascii=False)
+
+
+def csv_line(row: tuple) -> str:
+    buffer = io.StringIO()
+    csv.writer(buffer, lineterminator="").writerow(row)
+    return buffer.getvalue()
+
+
+LINE_ENCODERS = {"jsonl": jsonl_line, "csv": csv_line}
+
+
+def open_export(path: str, export_format: str, streaming: bool):
+    """Exporter for path in the given --format.
+
+    Every exporter takes pages through write_page() and is closed with
+    finalize(). Text pages are rendered lines, the other formats take row
+    tuples in EXPORT_FIELDS order. With streaming, pages arrive newest first
+    and the line formats are spooled so the file still ends up chronological.
+    An archive is a folder that keeps its order itself (see ArchiveExport).
+    """
+    if export_format == "sqlite":
+        return SqliteExport(path)
+    if export_format == "archive":
+        return ArchiveExport(path)
+    encode = LINE_ENCODERS.get(export_format)
+    header = csv_line(EXPORT_FIELDS) if export_format == "csv" else None
+    if streaming:
+        return SegmentedExport(path, encode, header)
+    return FileExport(path, encode, header)
+
+
+class SegmentedExport:
+    """Constant-memory text export for pages that arrive newest first.
+
+    Each page is rendered (oldest line first) and appended to a spool file
+    as one segment, so only the segment offsets stay in memory. finalize()
+    copies the segments to the output file in reverse order, which gives a
+    chronological file without ever holding the whole chat.
+    """
+
+    def __init__(self, path: str, encode=None, header: str | None = None):
+        self.path = path
+        self.encode = encode  # Turns a page entry into its line, None if entries are lines already
+        self.header = header
+        self.spool_path = f"{path}.segments"
+        self._spool = None
+        self._offsets = array("q")  # Start of every segment in the spool file
+        self.lines = 0
+
+    def write_page(self, lines: list):
+        """Append one page worth of lines (already in chronological order)"""
+        if not lines:
+            return
+        if self.encode is not None:
+            lines = [self.encode(line) for line in lines]
+        if self._spool is None:
+            self._spool = open(self.spool_path, "w+b")
+        self._offsets.append(self._spool.tell())
+        self._spool.write(("\n".join(lines) + "\n").encode("UTF-8"))
+        self.lines += len(lines)
+
+    def finalize(self):
+        """Write the chronological output file and remove the spool"""
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, "wb") as out:
+            if self.header is not None:
+                out.write(f"{self.header}\n".encode("UTF-8"))
+            if self._spool is not None:
+                self._spool.flush()
+                end = self._spool.tell()
+                for start in reversed(self._offsets):
+                    self._spool.seek(start)
+                    copy_range(self._spool, out, end - start)
+                    end = start
+        os.replace(tmp_path, self.path)
+        self.discard()
+
+    def discard(self):
+        if self._spool is not None:
+            self._spool.close()
+            self._spool = None
+        if os.path.exists(self.spool_path):
+            os.remove(self.spool_path)
+        self._offsets = array("q")
+
+
+class FileExport:
+    """Buffered export of pages that are written in their final order"""
+
+    def __init__(self, path: str, encode=None, header: str | None = None):
+        self.path = path
+        self.encode = encode
+        self.lines = 0
+        self._file = open(path, "w", encoding="UTF-8", newline="", buffering=COPY_CHUNK)
+        if header is not None:
+            self._file.write(f"{header}\n")
+
+    def write_page(self, lines: list):
+        if not lines:
+            return
+        if self.encode is not None:
+            lines = [self.encode(line) for line in lines]
+        self._file.write("\n".join(lines) + "\n")
+        self.lines += len(lines)
+
+    def finalize(self):
+        self._file.close()
+
+
+class SqliteExport:
+    """Export into the messages table of a SQLite file, one transaction per page.
+
+    Rows are keyed by (thread_id, item_id), so exporting the same chat
+    again updates it instead of duplicating it.
+    """
+
+    def __init__(self, path: str):
+        self.path = path
+        self.lines = 0
+        # Only ever used by one scrape at a time, but that can be a worker thread
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.executescript(SQLITE_SCHEMA)
+
+    def write_page(self, rows: list):
+        if not rows:
+            return
+        with self.conn:
+            self.conn.executemany(f"INSERT OR REPLACE INTO messages VALUES ({', '.join('?' * len(EXPORT_FIELDS))})", rows)
+        self.lines += len(rows)
+
+    def finalize(self):
+        self.conn.close()
+
+
+def copy_range(src, dst, length: int):
+    """Copy length bytes from the current position of src into dst"""
+    while length > 0:
+        chunk = src.read(min(COPY_CHUNK, length))
+        if not chunk:
+            break
+        dst.write(chunk)
+        length -= len(chunk)
@@ -0,0 +1,71 @@
+import requests
+from requests.adapters import HTTPAdapter
+from requests.structures import CaseInsensitiveDict
+from requests.utils import DEFAULT_ACCEPT_ENCODING
+
+try:
+    import aiohttp
+except ImportError:  # Only needed by the --async engine
+    aiohttp = None
+
+DEFAULT_POOL_SIZE = 10
+DEFAULT_CONNECT_TIMEOUT = 10
+DEFAULT_READ_TIMEOUT = 30
+
+
+class HTTPClient:
+    """Shared keep-alive HTTP client for every request made to Instagram.
+
+    Holds one pooled requests.Session, so consecutive cursor pages reuse the
+    same TLS connection instead of paying for a new handshake each time.
+    Headers and the sessionid cookie are set once on the session.
+    """
+
+    def __init__(self, sessionid: str, headers: dict, pool_size: int = DEFAULT_POOL_SIZE,
+                 connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT):
+        self.pool_size = pool_size
+        self.timeout = (connect_timeout, read_timeout)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size, pool_block=True)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+
+        self.set_headers(headers)
+        self.session.cookies.set("sessionid", sessionid)
+
+    def set_headers(self, headers: dict):
+        """Send these headers from now on (plus compression and keep-alive)"""
+        self.headers = headers
+        session_headers = CaseInsensitiveDict(headers)
+        session_headers["accept-encoding"] = DEFAULT_ACCEPT_ENCODING
+        session_headers["connection"] = "keep-alive"
+        self.session.headers = session_headers  # Swapped whole, requests in flight keep the old ones
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        """GET through the pooled session using the client's timeouts"""
+        kwargs.setdefault("timeout", self.timeout)
+        return self.session.get(url, **kwargs)
+
+    def close(self):
+        self.session.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+
+def open_async_session(sessionid: str, headers: dict, pool_size: int = DEFAULT_POOL_SIZE,
+                       connect_timeout: float = DEFAULT_CONNECT_TIMEOUT, read_timeout: float = DEFAULT_READ_TIMEOUT):
+    """aiohttp counterpart of HTTPClient, used by the --async engine.
+
+    Must be called from inside a running event loop; use it with `async with`.
+    """
+    if aiohttp is None:
+        raise RuntimeError("The async engine needs aiohttp, install it with `uv add aiohttp` or `pip install aiohttp`")
+    connector = aiohttp.TCPConnector(limit=pool_size, keepalive_timeout=60)
+    timeout = aiohttp.ClientTimeout(sock_connect=connect_timeout, sock_read=read_timeout)
+    return aiohttp.ClientSession(headers=headers, cookies={"sessionid": sessionid},
+                                 connector=connector, timeout=timeout)
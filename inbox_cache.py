@@ -0,0 +1,38 @@
+import json
+import time
+
+from checkpoint import atomic_write
+
+DEFAULT_INBOX_CACHE = "inbox_cache.json"
+DEFAULT_INBOX_TTL = 900  # Seconds
+
+
+class InboxCache:
+    """Local copy of the enumerated inbox.
+
+    Keeps one small entry per chat (thread_id, title, users,
+    last_activity_at, pending) with the time it was fetched, so repeated
+    listings and name lookups within the TTL don't page through the inbox
+    again. The cache is only written once the whole inbox has been read.
+    """
+
+    def __init__(self, path: str, ttl: float, sessionid: str):
+        self.path = path
+        self.ttl = ttl
+        # Only keep the tail of the sessionid, so the file tells accounts apart without holding the cookie
+        self.account = sessionid[-8:]
+
+    def load(self) -> list | None:
+        """The cached entries, None if there are none or they are older than the TTL"""
+        try:
+            with open(self.path, encoding="UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if data.get("account") != self.account or time.time() - data.get("fetched_at", 0) > self.ttl:
+            return None
+        return data["threads"]
+
+    def save(self, threads: list):
+        atomic_write(self.path, json.dumps({"account": self.account, "fetched_at": time.time(), "threads": threads}))
@@ -0,0 +1,81 @@
+import json
+import time
+
+from checkpoint import atomic_write
+
+DEFAULT_INBOX_SNAPSHOT = "inbox_snapshot.json"
+
+
+def new_activity(entry: dict, marker: dict | None) -> dict | None:
+    """How much a chat's inbox entry moved on since marker, None if it didn't.
+
+    A chat is changed when its newest item is another one than at the
+    marker, or, without item ids, when its last activity is later. Entries
+    whose newest item is the same are left out even if their activity time
+    moved (reactions, seen receipts), since that adds no messages.
+    new_items counts the inbox's preview items newer than the marker; when
+    all of them are (more is set) there may be more than the preview shows.
+    """
+    recent = entry.get("recent", [])
+    if marker is None:
+        return {"new_chat": True, "new_items": len(recent), "more": True, "gap": entry.get("last_activity_at", 0)}
+
+    newest_item_id = entry.get("newest_item_id")
+    if newest_item_id is not None and marker.get("newest_item_id") is not None:
+        if newest_item_id == marker["newest_item_id"]:
+            return None
+    elif entry.get("last_activity_at", 0) <= marker.get("last_activity_at", 0):
+        return None
+
+    new_items = sum(1 for timestamp in recent if timestamp > marker.get("last_activity_at", 0))
+    return {"new_chat": False, "new_items": new_items, "more": bool(recent) and new_items == len(recent),
+            "gap": entry.get("last_activity_at", 0) - marker.get("last_activity_at", 0)}
+
+
+class InboxSnapshot:
+    """Activity markers of every chat as of the last time it was scraped completely.
+
+    One marker per chat (last_activity_at and the id of its newest item,
+    both straight from the inbox listing), so comparing a fresh listing
+    against them tells which chats have anything new without requesting a
+    single thread page. Markers come from the listing a run was scheduled
+    from, not from after the scrape, so messages that arrive during a run
+    show up as changes on the next one. Written with atomic_write, for the
+    account it was made with, like InboxCache.
+    """
+
+    def __init__(self, path: str, sessionid: str):
+        self.path = path
+        self.account = sessionid[-8:]
+        self.markers: dict = {}
+        try:
+            with open(self.path, encoding="UTF-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("account") == self.account:
+            self.markers = data.get("threads", {})
+
+    def changes(self, entries) -> list:
+        """The work queue: inbox entries of the chats that changed, most new activity first.
+
+        Every entry gets an "activity" dict (see new_activity). Chats never
+        scraped come first, then the most new preview items, then the
+        longest stretch of new activity.
+        """
+        queue = []
+        for entry in entries:
+            activity = new_activity(entry, self.markers.get(entry["thread_id"]))
+            if activity is not None:
+                queue.append({**entry, "activity": activity})
+        queue.sort(key=lambda entry: (not entry["activity"]["new_chat"], -entry["activity"]["new_items"],
+                                      -entry["activity"]["gap"]))
+        return queue
+
+    def mark(self, entry: dict):
+        """Remember a chat's inbox entry as scraped"""
+        self.markers[entry["thread_id"]] = {"last_activity_at": entry.get("last_activity_at", 0),
+                                            "newest_item_id": entry.get("newest_item_id"), "scraped_at": time.time()}
+
+    def save(self):
+        atomic_write(self.path, json.dumps({"account": self.account, "threads": self.markers}))
@@ -1,59 +1,217 @@
+import asyncio
+import heapq
 import os
+import queue
+import sqlite3
 import sys
 import threading
 import time
 import traceback
-import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, as_completed
 from datetime import datetime
-from turtle import color
+from itertools import batched
 
-import requests
 from termcolor import colored
 import argparse
 
-# Working headers based on diagnostic test
-headers = {
-    "accept": "*/*",
-    "accept-language": "en-US,en;q=0.9",
-    "referer": "https://www.instagram.com/",
-    "sec-fetch-dest": "empty",
-    "sec-fetch-mode": "cors",
-    "sec-fetch-site": "same-origin",
-    "user-agent": "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/120.0.0.0 Safari/537.36",
-    "x-asbd-id": "129477",
-    "x-ig-app-id": "936619743392459",
-    "x-ig-www-claim": "0",
-    "x-requested-with": "XMLHttpRequest",
-}
+from api_config import ApiConfigCache, DEFAULT_API_CONFIG, header_configs, probe
+from archive import ArchiveReader
+from checkpoint import Checkpoint, DEFAULT_CHECKPOINT_DIR, DEFAULT_CHECKPOINT_EVERY, RECENT_CURSORS
+from cursor_index import CursorIndex, DEFAULT_CURSOR_INDEX
+from dm_client import (DMClient, RateLimited, RequestFailed, SeenIndex, check_item, has_prev_cursor, get_prev_cursor,
+                       reaches_end, DEFAULT_API_URL, HEADERS)
+from export import open_export, EXPORT_FORMATS
+from http_client import HTTPClient, open_async_session, DEFAULT_POOL_SIZE, DEFAULT_READ_TIMEOUT
+from inbox_cache import InboxCache, DEFAULT_INBOX_CACHE, DEFAULT_INBOX_TTL
+from inbox_snapshot import InboxSnapshot, DEFAULT_INBOX_SNAPSHOT
+from media import MediaDownloader, DEFAULT_MEDIA_DIR, DEFAULT_MEDIA_WORKERS
+from message_store import MessageStore, DEFAULT_STORE_PATH
+from metrics import Metrics, serve_metrics
+from rate_governor import (RateGovernor, PollInterval, DEFAULT_RATE, DEFAULT_MIN_RATE,
+                           DEFAULT_MAX_RATE, DEFAULT_BURST, DEFAULT_MAX_RETRIES, DEFAULT_MAX_BACKOFF,
+                           DEFAULT_POLL_MIN, DEFAULT_POLL_MAX)
+from page_cache import PageCache, DEFAULT_PAGE_CACHE, DEFAULT_CACHE_TTL, DEFAULT_CACHE_SIZE
+from records import MessageRecord
+from render import LineRenderer, ConsoleWriter, LINE_TEMPLATES, color_enabled, resolve_template
+from search_index import SearchIndex, DEFAULT_SEARCH_INDEX, DEFAULT_SEARCH_LIMIT
+
+
+class RunOptions:
+    """The command line settings of a run that the scrape functions read.
+
+    parse_args() (or the interactive prompts) fill in OPTIONS, and every
+    ThreadScrape is created with it, so code that is handed a scrape reads
+    them as scrape.options.
+    """
+
+    def __init__(self):
+        self.thread_id: str | None = None  # -t as given: ids or names, separated by commas
+        self.file_path: str | None = None
+        self.since: datetime | None = None
+        self.until: datetime | None = None
+        self.verbose = False
+        self.dedup_window: int | None = None
+        self.keep_raw = False
+        self.stream_export = False
+        self.export_format = "text"
+        self.line_template = LINE_TEMPLATES["default"]
+        self.pager: str | None = None
+        self.tail: int | None = None
+        self.prefetch = DEFAULT_PREFETCH
+        self.resume = False
+        self.checkpoint_every = DEFAULT_CHECKPOINT_EVERY
+        self.checkpoint_dir = DEFAULT_CHECKPOINT_DIR
+
+
+# Use www.instagram.com instead of i.instagram.com
+API_URL = DEFAULT_API_URL
 
 SESSIONID = None
-THREADID = None
-VERBOSE = False
-FILE_PATH = None
-PREV_CURSOR = ""
-OLDEST_CURSOR = ""
-USED_CURSORS: list = list()
-LAST_RESPONSE = None
-MESSAGES: list = list()
+API_HEADERS = HEADERS  # The cached working configuration's headers once init_client() has run
+API_CONFIG: ApiConfigCache | None = None
+CLIENT: DMClient | None = None
+INBOX_CACHE: InboxCache | None = None
+INBOX_SNAPSHOT: InboxSnapshot | None = None
+INBOX_LISTING: dict = {}  # thread_id: inbox entry of every chat listed this run, see mark_scraped
+SCRAPES: list = list()  # Every ThreadScrape of this run, for progress and force_exit
 IS_WAITING = True
-MEMBERS: dict = dict()
-TOTAL_TIME = 0
-RATE: list = [0]
-LIMIT_DATE = None
-REQUESTS_AMMOUNT = 0
-STREAMED_MESSAGES: list = []
-TO_STREAM: list = []
+STOPPING = threading.Event()  # Set on Ctrl-C in bulk mode, workers stop after their current page
+CURSOR_INDEX: CursorIndex | None = None
+SEARCH: SearchIndex | None = None
+STORE: MessageStore | None = None
+EXPORT_BATCH = 1000  # Rows per write when exporting a finished chat in a structured format
+MEDIA: MediaDownloader | None = None
+METRICS = Metrics()
+DEFAULT_STREAM_WINDOW = 200  # Item ids each live chat remembers
+STREAM_CATCH_UP_PAGES = 5
+DEFAULT_PREFETCH = 2  # Pages fetched ahead of the one being processed
+_END = object()  # Marks the end of prefetched pages
+OPTIONS = RunOptions()
 PARSER = argparse.ArgumentParser()
 ARGS = None
 
 # Creating args
 PARSER.add_argument("-s", "--sessionid", dest="sessionid", type=str, help="Account's Sessionid")
-PARSER.add_argument("-S", "--stream", dest="stream", action="store_true")
-PARSER.add_argument("-t", "--threadid", dest="threadid", type=str, help="Chat's Threadid")  # Changed to str
+PARSER.add_argument("-S", "--stream", dest="stream", action="store_true",
+                    help="Follow the chat(s) live and print new messages as they arrive")
+PARSER.add_argument("-t", "--threadid", dest="threadid", type=str,
+                    help="Chat's Threadid or name, or several separated by commas")  # Changed to str
 PARSER.add_argument("-v", "--verbose", dest="verbose", action="store_true")
 PARSER.add_argument("-o", "--output", dest="output", type=str, help="Output file")
-PARSER.add_argument("-d", "--date", dest="date", type=str, help="Limit date")
+PARSER.add_argument("-d", "--date", "--since", dest="date", type=str,
+                    help="Limit date, only messages from then on are fetched (dd/mm/yyyy[@hh:mm:ss])")
+PARSER.add_argument("--until", dest="until", type=str,
+                    help="Only messages up to this date (dd/mm/yyyy[@hh:mm:ss]), paging starts near it if the chat was scraped before")
+PARSER.add_argument("--cursor-index", dest="cursor_index", type=str, default=DEFAULT_CURSOR_INDEX,
+                    help=f"SQLite file remembering the time range of every fetched page (default: {DEFAULT_CURSOR_INDEX})")
 PARSER.add_argument("-l", "--list", dest="list", action="store_true")
+PARSER.add_argument("--dedup-window", dest="dedup_window", type=int,
+                    help="Only remember the last N item ids for duplicate checks (saves memory on huge threads)")
+PARSER.add_argument("--pool-size", dest="pool_size", type=int, default=DEFAULT_POOL_SIZE,
+                    help="Max keep-alive connections kept open to Instagram")
+PARSER.add_argument("--timeout", dest="timeout", type=float, default=DEFAULT_READ_TIMEOUT,
+                    help="Read timeout per request in seconds")
+PARSER.add_argument("--rate", dest="rate", type=float, default=DEFAULT_RATE,
+                    help="Initial request rate (requests/second), adapts to Instagram's responses")
+PARSER.add_argument("--min-rate", dest="min_rate", type=float, default=DEFAULT_MIN_RATE,
+                    help="Lowest request rate after slowing down on 429/5xx")
+PARSER.add_argument("--max-rate", dest="max_rate", type=float, default=DEFAULT_MAX_RATE,
+                    help="Highest request rate reached while responses are healthy")
+PARSER.add_argument("--burst", dest="burst", type=int, default=DEFAULT_BURST,
+                    help="Requests allowed back to back before pacing kicks in")
+PARSER.add_argument("--max-retries", dest="max_retries", type=int, default=DEFAULT_MAX_RETRIES,
+                    help="Retries of a failed page before giving up")
+PARSER.add_argument("--max-backoff", dest="max_backoff", type=float, default=DEFAULT_MAX_BACKOFF,
+                    help="Longest wait between retries in seconds")
+PARSER.add_argument("--sync", dest="sync", action="store_true",
+                    help="Keep messages in a local store and only fetch the ones newer than what's stored")
+PARSER.add_argument("--store", dest="store", type=str, default=DEFAULT_STORE_PATH,
+                    help="SQLite file used by --sync")
+PARSER.add_argument("--resume", dest="resume", action="store_true",
+                    help="Continue an interrupted run from its last checkpoint")
+PARSER.add_argument("--checkpoint-every", dest="checkpoint_every", type=int, default=DEFAULT_CHECKPOINT_EVERY,
+                    help="Save progress to disk every N pages (0 disables checkpoints)")
+PARSER.add_argument("--checkpoint-dir", dest="checkpoint_dir", type=str, default=DEFAULT_CHECKPOINT_DIR,
+                    help="Directory for checkpoint files")
+PARSER.add_argument("-A", "--all-threads", dest="all_threads", action="store_true",
+                    help="Archive every chat in the inbox")
+PARSER.add_argument("-w", "--workers", dest="workers", type=int, default=4,
+                    help="How many chats are scraped at the same time when archiving several")
+PARSER.add_argument("--output-dir", dest="output_dir", type=str, default="archive",
+                    help="Where each chat's file goes when archiving several chats")
+PARSER.add_argument("--async", dest="use_async", action="store_true",
+                    help="Use the asyncio engine (needs aiohttp): all chats run on one event loop")
+PARSER.add_argument("--stream-export", dest="stream_export", action="store_true",
+                    help="Write each page to the output file as it arrives instead of keeping the chat in memory")
+PARSER.add_argument("--keep-raw", dest="keep_raw", action="store_true",
+                    help="Keep the full API item of every message (uses a lot more memory)")
+PARSER.add_argument("--media", dest="media", action="store_true",
+                    help="Download photos, videos, voice messages and temporary media while fetching")
+PARSER.add_argument("--media-dir", dest="media_dir", type=str, default=DEFAULT_MEDIA_DIR,
+                    help="Folder for downloaded media and its manifest")
+PARSER.add_argument("--media-workers", dest="media_workers", type=int, default=DEFAULT_MEDIA_WORKERS,
+                    help="How many media files are downloaded at the same time")
+PARSER.add_argument("--stats-file", dest="stats_file", type=str,
+                    help="Keep run statistics in this file: Prometheus text if it ends in .prom or .txt, JSON otherwise")
+PARSER.add_argument("--stats-interval", dest="stats_interval", type=float, default=10,
+                    help="Seconds between updates of --stats-file")
+PARSER.add_argument("--metrics-port", dest="metrics_port", type=int,
+                    help="Serve the statistics on http://127.0.0.1:PORT/metrics (Prometheus) and /stats.json")
+PARSER.add_argument("--format", dest="format", choices=list(EXPORT_FORMATS), default="text",
+                    help="Export format: text lines, or normalized rows as JSONL, CSV, a SQLite table or a compressed archive "
+                         "folder that later runs add to (read it with --read-archive)")
+PARSER.add_argument("--index", dest="index", action="store_true",
+                    help="Add the scraped messages to the local search index (--search-index)")
+PARSER.add_argument("--search-index", dest="search_index", type=str, default=DEFAULT_SEARCH_INDEX,
+                    help=f"SQLite full-text index of scraped messages (default: {DEFAULT_SEARCH_INDEX})")
+PARSER.add_argument("--search", dest="search", type=str,
+                    help='Search the index instead of scraping: words, "a phrase", prefix*, a OR b ("" for filters only). '
+                         "Narrow it down with -t, --from, --type, --since and --until")
+PARSER.add_argument("--from", dest="sender", type=str, help="With --search, only messages from this name (or user id)")
+PARSER.add_argument("--type", dest="item_type", type=str, help="With --search, only this item type (text, media, ...)")
+PARSER.add_argument("--search-limit", dest="search_limit", type=int, default=DEFAULT_SEARCH_LIMIT,
+                    help=f"Most results --search shows (default: {DEFAULT_SEARCH_LIMIT})")
+PARSER.add_argument("--read-archive", dest="read_archive", type=str,
+                    help="Print the messages of an archive made with --format archive instead of scraping. "
+                         "Narrow it down with --since, --until and --tail, -o writes them to a text file")
+PARSER.add_argument("--template", dest="template", type=str, default="default",
+                    help=f"Line template of text output: {', '.join(LINE_TEMPLATES)} or a format string with "
+                         "{name}, {text}, {time}, {type}, {id} and {url}")
+PARSER.add_argument("--tail", dest="tail", type=int,
+                    help="Only show the last N messages on the console (the file still gets all of them)")
+PARSER.add_argument("--pager", dest="pager", nargs="?", const=os.environ.get("PAGER", "less -R"),
+                    help="Show console output in a pager (default: $PAGER or less -R)")
+PARSER.add_argument("--page-cache", dest="page_cache", nargs="?", const=DEFAULT_PAGE_CACHE,
+                    help=f"Keep fetched thread pages in this SQLite file and reuse them on later runs (default: {DEFAULT_PAGE_CACHE})")
+PARSER.add_argument("--cache-ttl", dest="cache_ttl", type=float, default=DEFAULT_CACHE_TTL,
+                    help=f"Seconds a cached page is reused (default: {DEFAULT_CACHE_TTL})")
+PARSER.add_argument("--cache-size", dest="cache_size", type=float, default=DEFAULT_CACHE_SIZE,
+                    help=f"MB the page cache may take before the least recently used pages are dropped (default: {DEFAULT_CACHE_SIZE})")
+PARSER.add_argument("--offline", dest="offline", action="store_true",
+                    help="Replay chats from the page cache only, without a session or any request")
+PARSER.add_argument("--inbox-cache", dest="inbox_cache", type=str, default=DEFAULT_INBOX_CACHE,
+                    help="File the chat list is cached in")
+PARSER.add_argument("--inbox-ttl", dest="inbox_ttl", type=float, default=DEFAULT_INBOX_TTL,
+                    help="Seconds the cached chat list is used before the inbox is fetched again")
+PARSER.add_argument("--refresh-inbox", dest="refresh_inbox", action="store_true",
+                    help="Ignore the cached chat list and fetch the inbox again")
+PARSER.add_argument("--changed", dest="changed", action="store_true",
+                    help="With -A, only scrape the chats with new activity since they were last scraped, most active first. "
+                         "With -l, list them")
+PARSER.add_argument("--inbox-snapshot", dest="inbox_snapshot", type=str, default=DEFAULT_INBOX_SNAPSHOT,
+                    help=f"File with every chat's activity as of its last complete scrape (default: {DEFAULT_INBOX_SNAPSHOT})")
+PARSER.add_argument("--api-config", dest="api_config", type=str, default=DEFAULT_API_CONFIG,
+                    help=f"File remembering the fastest working API url and headers, found again when requests fail (default: {DEFAULT_API_CONFIG})")
+PARSER.add_argument("--probe", dest="probe", action="store_true",
+                    help="Probe every API url and header configuration at startup instead of using the remembered one")
+PARSER.add_argument("--prefetch", dest="prefetch", type=int, default=DEFAULT_PREFETCH,
+                    help=f"Pages fetched ahead while the current one is processed (default: {DEFAULT_PREFETCH}, 0: one after the other)")
+PARSER.add_argument("--poll-min", dest="poll_min", type=float, default=DEFAULT_POLL_MIN,
+                    help="Seconds between polls of a chat in stream mode while messages are coming in")
+PARSER.add_argument("--poll-max", dest="poll_max", type=float, default=DEFAULT_POLL_MAX,
+                    help="Longest wait between polls of an idle chat in stream mode")
+
 
 def force_exit():
     """Called when the program is abruptly terminated"""
@@ -61,131 +219,227 @@ def force_exit():
     print(colored(f"\nProgram exit before time... Printing fetched messages... [{datetime.now().strftime('%d/%m/%Y @ %H:%M:%S')}]", "red"))
     IS_WAITING = False
     time.sleep(0.5)  # Give threads time to stop
-    print_messages()
+    for scrape in SCRAPES:
+        if not scrape.done:
+            save_checkpoint(scrape, announce=True)
+            flush_output(scrape)
+    if CURSOR_INDEX is not None:
+        CURSOR_INDEX.flush()
+    if INBOX_SNAPSHOT is not None:
+        mark_scraped()
+    if ARGS.stats_file:
+        METRICS.write(ARGS.stats_file)
     sys.exit(1)
 
 
-def rate_limit():
-    global IS_WAITING
-    IS_WAITING = False
-    raise RuntimeError("You're being rate-limited (HTTP 429)")
+class ThreadScrape:
+    """Everything that belongs to the scrape of one chat.
+
+    Keeping this per chat (instead of in module globals) is what lets
+    several chats be scraped side by side by the worker pool.
+    """
+
+    def __init__(self, thread_id: str, options: RunOptions, file_path: str | None = None, label: str | None = None):
+        self.thread_id = thread_id
+        self.options = options
+        self.file_path = file_path
+        # The --since/--until window in the API's microseconds, so items are compared without datetimes
+        self.since = int(options.since.timestamp() * 1000000) if options.since is not None else None
+        self.until = int(options.until.timestamp() * 1000000) if options.until is not None else None
+        self.label = label  # Prefix for console lines when several chats run at once
+        self.messages: list = []  # Stays empty when exporting with --stream-export
+        self.count = 0  # Messages kept so far, wherever they went
+        self.exporter = None  # --stream-export, open from begin_scrape() until flush_output()
+        self.seen = SeenIndex(options.dedup_window)
+        self.members: dict = {}
+        self.renderer: LineRenderer | None = None  # Text lines of the file, see render_message
+        self.last_response = None
+        self.pages = 0  # Pages fetched so far
+        self.recent_cursors: deque = deque(maxlen=RECENT_CURSORS)  # Cursors of the last of them
+        self.current_cursor = None
+        self.checkpoint: Checkpoint | None = None
+        self.sync_newest = None  # (item_id, timestamp) of the newest stored item in --sync mode
+        self.done = False
+        self.completed = False  # Paged all the way through, see end_scrape
+
+    def say(self, text: str, color: str | None = None):
+        """Print a status line, tagged with the chat when running several"""
+        if self.label:
+            text = f"[{self.label}] {text.lstrip()}"
+        # One write per line so lines from several workers don't run into each other
+        print((colored(text, color) if color else text) + "\n", end="")
 
 
 def has_args():
     global ARGS
-    return not (ARGS.date is None and ARGS.output is None and ARGS.sessionid is None 
-                and ARGS.stream is False and ARGS.threadid is None and ARGS.verbose is False 
-                and ARGS.list is False)
+    return any(value != PARSER.get_default(name) for name, value in vars(ARGS).items())
+
+
+def init_client():
+    """Create the shared DMClient, inbox cache and inbox snapshot once SESSIONID is known"""
+    global CLIENT, INBOX_CACHE, INBOX_SNAPSHOT, API_CONFIG, API_HEADERS
+    if CLIENT is not None:
+        CLIENT.close()
+    API_CONFIG = ApiConfigCache(ARGS.api_config, SESSIONID)
+    api_url, API_HEADERS = API_URL, HEADERS
+    # Unless it was pointed somewhere else (benchmarks), where probing instagram.com means nothing
+    configurable = API_URL == DEFAULT_API_URL and not ARGS.offline
+    if configurable:
+        config = probe_api() if ARGS.probe else API_CONFIG.load()
+        if config is not None:
+            api_url, API_HEADERS = config["api_url"], config["headers"]
+    http = HTTPClient(SESSIONID, API_HEADERS, pool_size=ARGS.pool_size, read_timeout=ARGS.timeout)
+    governor = RateGovernor(rate=ARGS.rate, min_rate=ARGS.min_rate, max_rate=ARGS.max_rate, burst=ARGS.burst,
+                            max_retries=ARGS.max_retries, max_backoff=ARGS.max_backoff)
+    cache = None
+    if (ARGS.page_cache or ARGS.offline) and not ARGS.stream:  # Live chats always need the newest page
+        cache = PageCache(ARGS.page_cache or DEFAULT_PAGE_CACHE, ARGS.cache_ttl, int(ARGS.cache_size * 1024 * 1024))
+    CLIENT = DMClient(http, governor, METRICS, api_url, OPTIONS.verbose, log, cache, ARGS.offline,
+                      revalidate_api if configurable else None)
+    INBOX_CACHE = InboxCache(ARGS.inbox_cache, ARGS.inbox_ttl, SESSIONID)
+    INBOX_SNAPSHOT = InboxSnapshot(ARGS.inbox_snapshot, SESSIONID)
+
+
+def probe_api(current: tuple | None = None):
+    """Probe every API url and header configuration at once, remember and return the fastest working one (or None).
+
+    If the current (api_url, headers) still works it is kept, nothing is
+    saved and None is returned: the rejection was about the request, not
+    the configuration.
+    """
+    log("Probing the API configurations...", "cyan")
+    results = probe(SESSIONID)
+    configs = header_configs(SESSIONID)
+    if current is not None and any(result["ok"] and (result["api_url"], configs[result["name"]]) == current
+                                   for result in results):
+        log("The current API configuration still works, keeping it", "green")
+        return None
+    best = results[0]
+    if not best["ok"]:
+        log("No API configuration works, the session may be invalid", "red")
+        return None
+    log(f"Using {best['name']} on {best['api_url']} ({best['seconds'] * 1000:.0f} ms)", "green")
+    API_CONFIG.save(best)
+    return {**best, "headers": configs[best["name"]]}
+
+
+def revalidate_api():
+    """DMClient's revalidate(): the (api_url, headers) to switch to after Instagram rejected a request"""
+    global API_HEADERS
+    log("\n[!] Instagram rejected the request, looking for a configuration that works", "yellow")
+    config = probe_api((CLIENT.api_url, API_HEADERS))
+    if config is None:
+        return None
+    API_HEADERS = config["headers"]
+    return config["api_url"], config["headers"]
 
 
 def parse_args():
-    global SESSIONID, THREADID, VERBOSE, FILE_PATH, LIMIT_DATE
+    global SESSIONID, STORE, MEDIA, CURSOR_INDEX, SEARCH
+    
+    try:
+        OPTIONS.line_template = resolve_template(ARGS.template)
+    except ValueError as e:
+        return (False, f"--template: {e}")
+    OPTIONS.pager, OPTIONS.tail = ARGS.pager, ARGS.tail
+    if ARGS.date is not None:
+        OPTIONS.since = parse_date(ARGS.date)
+    if ARGS.until is not None:
+        OPTIONS.until = parse_date(ARGS.until)
+        if OPTIONS.since is not None and OPTIONS.since > OPTIONS.until:
+            return (False, "--since is after --until")
+    
+    if ARGS.search is not None:
+        return (True, "search")  # Only reads the local index, no session needed
+    if ARGS.read_archive is not None:
+        return (True, "read_archive")
     
-    if ARGS.sessionid is None:
+    if ARGS.sessionid is None and not ARGS.offline:
         return (False, "No Sessionid was provided")
-    SESSIONID = ARGS.sessionid
+    if ARGS.offline and ARGS.stream:
+        return (False, "--offline can't stream live chats")
+    if ARGS.use_async and ARGS.stream:
+        return (False, "--async doesn't stream live chats")
+    SESSIONID = ARGS.sessionid or ""
+    init_client()
     
+    if ARGS.changed and not (ARGS.list or ARGS.all_threads):
+        return (False, "--changed works with -A or -l")
     if ARGS.list:
         return (True, "list")
     
-    if ARGS.threadid is None:
+    if ARGS.threadid is None and not ARGS.all_threads:
         return (False, "No Threadid was provided")
-    THREADID = str(ARGS.threadid)  # Ensure it's a string
+    OPTIONS.thread_id = str(ARGS.threadid)  # Ensure it's a string
     
+    OPTIONS.verbose = ARGS.verbose
+    CLIENT.verbose = OPTIONS.verbose
+    OPTIONS.file_path = ARGS.output
+    OPTIONS.dedup_window = ARGS.dedup_window
+    OPTIONS.keep_raw = ARGS.keep_raw
+    OPTIONS.prefetch = ARGS.prefetch
+    OPTIONS.resume = ARGS.resume
+    OPTIONS.checkpoint_every, OPTIONS.checkpoint_dir = ARGS.checkpoint_every, ARGS.checkpoint_dir
+    if ARGS.index:
+        SEARCH = SearchIndex(ARGS.search_index)
+    if ARGS.media:
+        MEDIA = MediaDownloader(ARGS.media_dir, ARGS.media_workers, HEADERS["user-agent"])
     if ARGS.stream:
+        # Streaming appends text lines to -o as they arrive, none of the export setup below applies
+        if ARGS.sync:
+            return (False, "--sync can't be used with -S")
+        if ARGS.format != "text":
+            return (False, f"-S only writes text, not --format {ARGS.format}")
         return (True, "stream")
 
-    VERBOSE = ARGS.verbose
-    FILE_PATH = ARGS.output
+    if ARGS.sync:
+        STORE = MessageStore(ARGS.store)
+    OPTIONS.stream_export = ARGS.stream_export
+    OPTIONS.export_format = ARGS.format
+    if OPTIONS.file_path is None and not ARGS.all_threads and "," not in OPTIONS.thread_id:
+        if OPTIONS.stream_export:
+            return (False, "--stream-export needs an output file (-o)")
+        if OPTIONS.export_format != "text":
+            return (False, f"--format {OPTIONS.export_format} needs an output file (-o)")
     
-    if ARGS.date is not None:
-        if "@" in ARGS.date:
-            LIMIT_DATE = datetime.strptime(ARGS.date, "%d/%m/%Y@%H:%M:%S")
-        else:
-            LIMIT_DATE = datetime.strptime(ARGS.date, "%d/%m/%Y")
+    CURSOR_INDEX = CursorIndex(ARGS.cursor_index)
+    
+    if ARGS.all_threads or "," in OPTIONS.thread_id:
+        return (True, "bulk")
     
     return (True, None)
 
 
-def get_request(url: str, headers: dict, cookies: dict):
-    """Make GET request with proper error handling"""
-    try:
-        r = requests.get(url, headers=headers, cookies=cookies, timeout=30)
-        global REQUESTS_AMMOUNT
-        REQUESTS_AMMOUNT += 1
-        
-        if VERBOSE:
-            print(colored(f"[DEBUG] Request to: {url}", "cyan"))
-            print(colored(f"[DEBUG] Status Code: {r.status_code}", "cyan"))
-        
-        if r.status_code == 429:
-            rate_limit()
-        elif r.status_code == 400:
-            print(colored(f"\nError: HTTP 400 - Bad Request", "red"))
-            print(colored("Possible causes:", "yellow"))
-            print(colored("  1. Invalid Thread ID format", "yellow"))
-            print(colored("  2. Session ID has incorrect format or expired", "yellow"))
-            print(colored("  3. Instagram has updated their API requirements", "yellow"))
-            if VERBOSE:
-                print(colored(f"\nResponse: {r.text[:500]}", "cyan"))
-            return None
-        elif r.status_code == 401:
-            print(colored(f"\nError: HTTP 401 - Unauthorized", "red"))
-            print(colored("Your session ID is invalid or expired. Get a new one!", "yellow"))
-            return None
-        elif r.status_code != 200:
-            print(colored(f"\nError: HTTP {r.status_code} - {r.reason}", "red"))
-            if VERBOSE:
-                print(colored(f"Response: {r.text[:500]}", "cyan"))
-            return None
-        
-        res = r.json()
-        global LAST_RESPONSE
-        LAST_RESPONSE = res
-        
-        if VERBOSE:
-            print(colored(f"[DEBUG] Response keys: {list(res.keys())}", "cyan"))
-        
-        return res
-        
-    except requests.exceptions.Timeout:
-        print(colored("Error: Request timed out", "red"))
-        return None
-    except requests.exceptions.ConnectionError:
-        print(colored("Error: Connection failed. Check your internet.", "red"))
-        return None
-    except json.JSONDecodeError:
-        print(colored("Error: Invalid JSON response", "red"))
-        if VERBOSE:
-            print(colored(f"Response text: {r.text[:500]}", "cyan"))
-        return None
-    except Exception as e:
-        print(colored(f"Error: {str(e)}", "red"))
-        return None
+def parse_date(text: str) -> datetime:
+    """Parse a dd/mm/yyyy[@hh:mm:ss] date"""
+    if "@" in text:
+        return datetime.strptime(text, "%d/%m/%Y@%H:%M:%S")
+    return datetime.strptime(text, "%d/%m/%Y")
+
 
+def get_page(scrape: ThreadScrape, cursor: str = ""):
+    """A page of the scrape's chat through the shared CLIENT (paced, retried and cached there), None if the request failed"""
+    return CLIENT.get_page(scrape.thread_id, cursor, scrape.options.keep_raw)
 
-def reverse_list(target_list):
-    """Reverses the target list"""
-    return list(reversed(target_list))
 
+def log(text: str, color: str | None = None):
+    """Console output of CLIENT"""
+    # One write per line so lines from several workers don't run into each other
+    print((colored(text, color) if color else text) + "\n", end="")
 
-def get_messages(cursor: str = ""):
-    """Request to get messages stored in that Cursor"""
-    # Use www.instagram.com instead of i.instagram.com
-    response = get_request(
-        f"https://www.instagram.com/api/v1/direct_v2/threads/{THREADID}/?cursor={cursor}", 
-        headers, 
-        {"sessionid": SESSIONID}
-    )
+
+def get_messages(scrape: ThreadScrape, cursor: str = ""):
+    """Request to get messages stored in that Cursor, None if the request failed"""
+    response = get_page(scrape, cursor)
     
     if response is None:
-        return []
+        return None
     
     if "thread" not in response:
-        print(colored("\nError: Invalid response - missing 'thread' key", "red"))
-        if "message" in response:
-            print(colored(f"Instagram says: {response['message']}", "yellow"))
-        return []
+        page_failed(scrape, response)
+        return None
+    
+    scrape.last_response = response
     
     if "items" not in response["thread"]:
         return []
@@ -193,269 +447,959 @@ def get_messages(cursor: str = ""):
     return response["thread"]["items"]
 
 
-def has_prev_cursor(cursor):
-    """Check if there's a Cursor older than the given one"""
-    return bool(LAST_RESPONSE.get("thread", {}).get("has_older", False))
+def page_failed(scrape: ThreadScrape, response: dict | None):
+    """Report a page that came back without a thread (CLIENT already reported failed requests)"""
+    if response is None:
+        return
+    scrape.say("\nError: Invalid response - missing 'thread' key", "red")
+    if "message" in response:
+        scrape.say(f"Instagram says: {response['message']}", "yellow")
+
 
+def last_page(scrape: ThreadScrape):
+    """The last_page hook of CLIENT.iter_pages(): paging ends where process_page() stops (--date or --sync)"""
+    return lambda items: reaches_end(items, scrape.since, scrape.sync_newest)
 
-def get_prev_cursor(cursor):
-    """Get the most recent cursor older than the given one"""
-    thread = LAST_RESPONSE.get("thread", {})
-    return thread.get("prev_cursor") or thread.get("oldest_cursor")
 
+def iter_pages(scrape: ThreadScrape, cursor: str | None):
+    """CLIENT.iter_pages() for a scrape, yields (cursor, items, response) from cursor towards the oldest.
+
+    A page that could not be fetched is yielded last, with items None.
+    """
+    try:
+        for cursor, response in CLIENT.iter_pages(scrape.thread_id, cursor, scrape.options.keep_raw, last_page(scrape)):
+            scrape.last_response = response
+            yield cursor, response["thread"].get("items", []), response
+    except RequestFailed as e:
+        page_failed(scrape, e.response)
+        yield e.cursor, None, None
 
-def get_all_messages(thread):
-    """Main loop to get all messages"""
-    global MESSAGES, RATE, TOTAL_TIME
+
+def prefetched(pages, depth: int):
+    """Iterate over pages on a background thread that stays at most depth pages ahead.
+
+    The bounded queue is the backpressure: the fetcher waits while depth
+    pages are waiting to be processed. Exceptions from the fetcher are
+    raised here. Closing the iterator stops the fetcher after its current
+    request. With depth 0 the pages are fetched in the caller's thread.
+    """
+    if depth <= 0:
+        yield from pages
+        return
     
-    current_cursor = thread.get('newest_cursor')
-    passed_limit_date = False
+    ready = queue.Queue(maxsize=depth)
+    done = threading.Event()
     
-    while True:
-        start = round(time.time() * 1000)
+    def put(entry):
+        while not done.is_set():
+            try:
+                ready.put(entry, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+    
+    def fetch():
+        try:
+            for page in pages:
+                if not put(page):
+                    return
+            put(_END)
+        except BaseException as e:
+            put(e)
+        finally:
+            pages.close()
+    
+    threading.Thread(target=fetch, daemon=True).start()
+    try:
+        while (entry := ready.get()) is not _END:
+            if isinstance(entry, BaseException):
+                raise entry
+            yield entry
+    finally:
+        done.set()
+
+
+def get_all_messages(scrape: ThreadScrape, thread: dict, prefetch: int = DEFAULT_PREFETCH):
+    """Main loop to get all messages, returns False if it stopped on a failed request.
+
+    Pages are requested up to prefetch (--prefetch) pages ahead on another
+    thread, so processing and exporting a page overlaps with the request for
+    the next.
+    """
+    pages = prefetched(iter_pages(scrape, thread.get('newest_cursor')), prefetch)
+    try:
+        for cursor, items, response in pages:
+            scrape.current_cursor = cursor
+            if items is None:
+                return False
+            if not items:
+                break
+            
+            next_cursor = take_page(scrape, cursor, items, response)
+            if next_cursor is None:
+                break
+            if STOPPING.is_set():
+                scrape.current_cursor = next_cursor  # Where --resume picks up
+                return False
+    finally:
+        pages.close()
+    
+    scrape.current_cursor = None
+    return True
+
+
+def take_page(scrape: ThreadScrape, cursor: str, items: list, response: dict):
+    """process_page() and finish_page() for a fetched page, returns the next cursor (None when done)"""
+    to_add, stop = process_page(scrape, items)
+    return finish_page(scrape, cursor, response, to_add, stop)
+
+
+def process_page(scrape: ThreadScrape, temp_messages: list):
+    """Filter one page of API items, returns (new MessageRecords, whether paging should stop)"""
+    to_add: list = []
+    verbose, keep_raw = scrape.options.verbose, scrape.options.keep_raw
+    
+    for temp_message in temp_messages:
+        if verbose:
+            print(colored(f"[*] Checking message with id {temp_message['item_id']}", 'yellow'))
         
-        if current_cursor is None:
-            break
+        # Newer than --until is kept in --sync mode anyway, the store must not have gaps
+        reason = check_item(temp_message, scrape.since, scrape.until if STORE is None else None, scrape.sync_newest)
         
-        temp_messages = get_messages(current_cursor)
-        if not temp_messages:
-            break
-            
-        to_add: list = []
+        # Check limit date
+        if reason == "since":
+            if verbose:
+                print(colored(f"[-] Reached limit date. Stopping...", "red"))
+            return to_add, True
         
-        for temp_message in temp_messages:
-            if VERBOSE:
-                print(colored(f"[*] Checking message with id {temp_message['item_id']}", 'yellow'))
-            
-            # Check limit date
-            if LIMIT_DATE is not None:
-                msg_timestamp = datetime.fromtimestamp(temp_message["timestamp"] / 1000000)
-                if LIMIT_DATE > msg_timestamp:
-                    passed_limit_date = True
-                    if VERBOSE:
-                        print(colored(f"[-] Reached limit date. Stopping...", "red"))
-                    break
-            
-            # Check for duplicates
-            if any(msg["item_id"] == temp_message["item_id"] for msg in MESSAGES):
-                if VERBOSE:
-                    print(colored(f"[-] Duplicate message, skipping...", "red"))
-                continue
-            
-            to_add.append(temp_message)
-            if VERBOSE:
-                print(colored(f"[+] Valid message added", "green"))
+        if reason == "until":
+            if verbose:
+                print(colored(f"[-] After the until date, skipping...", "red"))
+            continue
         
-        MESSAGES.extend(to_add)
+        # In --sync mode everything from here on is already stored
+        if reason == "stored":
+            if verbose:
+                print(colored(f"[-] Reached already stored messages. Stopping...", "red"))
+            return to_add, True
         
-        run_time = round(time.time() * 1000) - start
-        rate = (1000 * len(to_add)) / run_time if run_time > 0 else RATE[-1]
-        RATE.append(rate)
-        TOTAL_TIME += run_time
+        # Check for duplicates (also marks the id as seen)
+        if not scrape.seen.add(temp_message["item_id"]):
+            if verbose:
+                print(colored(f"[-] Duplicate message, skipping...", "red"))
+            continue
         
-        if has_prev_cursor(current_cursor) and not passed_limit_date:
-            current_cursor = get_prev_cursor(current_cursor)
-            time.sleep(1)  # Add delay to avoid rate limiting
-        else:
-            break
+        to_add.append(MessageRecord.from_item(temp_message, keep_raw))
+        if verbose:
+            print(colored(f"[+] Valid message added", "green"))
+    
+    return to_add, False
 
 
-def start():
-    """Main entry point for fetching messages"""
-    global MEMBERS, MESSAGES, TOTAL_TIME
+def finish_page(scrape: ThreadScrape, cursor: str, response: dict, to_add: list, stop: bool):
+    """Keep a processed page (fetched at cursor) and work out the next cursor (None when done)"""
+    keep_messages(scrape, to_add)  # ids were already indexed in process_page
+    METRICS.page(scrape.thread_id, len(to_add))
+    if CURSOR_INDEX is not None:
+        CURSOR_INDEX.add(scrape.thread_id, cursor, response["thread"].get("items", []))
+    scrape.pages += 1
+    scrape.recent_cursors.append(cursor)
     
-    print(colored("Connecting to Instagram...", "cyan"))
-    # Use www.instagram.com instead of i.instagram.com
-    resposta = get_request(
-        f"https://www.instagram.com/api/v1/direct_v2/threads/{THREADID}/?cursor=", 
-        headers, 
-        {"sessionid": SESSIONID}
-    )
+    if stop or not has_prev_cursor(response):
+        return None
     
-    if resposta is None:
-        print(colored("\nFailed to connect. Exiting...", "red"))
+    next_cursor = get_prev_cursor(response)  # Pacing is done by CLIENT in get_page
+    if scrape.checkpoint is not None and scrape.pages % scrape.options.checkpoint_every == 0:
+        scrape.current_cursor = next_cursor
+        save_checkpoint(scrape)
+    return next_cursor
+
+
+def keep_messages(scrape: ThreadScrape, items: list, from_checkpoint: bool = False):
+    """Hand new items (newest first) to wherever this scrape keeps them"""
+    scrape.count += len(items)
+    if MEDIA is not None:
+        MEDIA.add(scrape.thread_id, items)
+    if SEARCH is not None:
+        SEARCH.add([export_row(scrape, item) for item in items])
+    if scrape.checkpoint is not None and not from_checkpoint:
+        scrape.checkpoint.add(items)
+    if scrape.exporter is not None:
+        render = render_message if scrape.options.export_format == "text" else export_row
+        scrape.exporter.write_page([render(scrape, item) for item in reversed(items)])
+    else:
+        scrape.messages.extend(items)
+
+
+def save_checkpoint(scrape: ThreadScrape, announce: bool = False):
+    """Write the fetched messages and the cursor to resume from to disk"""
+    if scrape.checkpoint is None or scrape.current_cursor is None:
         return
+    scrape.checkpoint.save(scrape.pages, scrape.recent_cursors, scrape.current_cursor)
+    if announce:
+        scrape.say(f"Progress saved ({scrape.count} messages), continue later with --resume", "yellow")
+
+
+def start(scrape: ThreadScrape):
+    """Main entry point for fetching messages, returns True if the whole chat was fetched"""
+    scrape.say("Connecting to Instagram...", "cyan")
+    resposta = get_page(scrape)
+    
+    thread = begin_scrape(scrape, resposta)
+    if thread is None:
+        return False
+    
+    completed = get_all_messages(scrape, thread, scrape.options.prefetch)
+    end_scrape(scrape, completed)
+    return completed
+
+
+def begin_scrape(scrape: ThreadScrape, resposta: dict | None):
+    """Set a scrape up from the thread's first page, returns the thread or None"""
+    if resposta is None:
+        scrape.say("\nFailed to connect. Exiting...", "red")
+        scrape.done = True
+        return None
     
     if "thread" not in resposta:
-        print(colored("\nError: Unable to access thread", "red"))
+        scrape.say("\nError: Unable to access thread", "red")
         if "message" in resposta:
-            print(colored(f"Instagram says: {resposta['message']}", "yellow"))
-        return
+            scrape.say(f"Instagram says: {resposta['message']}", "yellow")
+        scrape.done = True
+        return None
     
     thread = resposta["thread"]
+    # Opened only now, so a bulk run holds one export per running chat instead of one per chat
+    if scrape.options.stream_export and scrape.file_path and STORE is None:
+        scrape.exporter = open_export(scrape.file_path, scrape.options.export_format, True)
     
     # Get members
     for user in thread.get("users", []):
-        MEMBERS[user["pk"]] = user["full_name"].split(" ")[0]
+        scrape.members[user["pk"]] = user["full_name"].split(" ")[0]
+    
+    resumed = False
+    if scrape.options.checkpoint_every > 0:
+        resumed = load_checkpoint(scrape, thread)
+    
+    if STORE is not None:
+        sync_prepare(scrape)
     
     # Get initial messages
-    items = thread.get("items", [])
-    MESSAGES = [items[0]] if items else []
+    if not resumed:
+        items = [MessageRecord.from_item(item, scrape.options.keep_raw) for item in thread.get("items", [])[:1]
+                 if (scrape.until is None or STORE is not None or int(item["timestamp"]) <= scrape.until)
+                 and scrape.seen.add(item["item_id"])]
+        keep_messages(scrape, items)
+        METRICS.page(scrape.thread_id, len(items))
+        if scrape.until is not None and STORE is None and CURSOR_INDEX is not None:
+            seek_until(scrape, thread)
     
-    print(colored("Fetching messages...\n", "cyan"))
-    get_all_messages(thread)
-    print_messages()
+    scrape.say("Fetching messages...\n", "cyan")
+    return thread
 
 
-def get_threads():
-    """Get a list of all chats"""
-    print(colored("Fetching your chats...", "cyan"))
-    # Use www.instagram.com instead of i.instagram.com
-    r = get_request(
-        "https://www.instagram.com/api/v1/direct_v2/inbox/?persistentBadging=true&folder=&limit=200", 
-        headers, 
-        {"sessionid": SESSIONID}
-    )
-    
-    if r is None:
+def seek_until(scrape: ThreadScrape, thread: dict):
+    """Start paging at the indexed page holding the end of the --until window instead of the newest one"""
+    found = CURSOR_INDEX.seek(scrape.thread_id, scrape.until)
+    if found is None:
         return
+    thread["newest_cursor"], newest = found
+    scrape.say(f"Skipping to a known page from {datetime.fromtimestamp(newest / 1000000).strftime('%d/%m/%Y @ %H:%M:%S')}", "cyan")
+
+
+def end_scrape(scrape: ThreadScrape, completed: bool):
+    """Checkpoint or clean up after paging, then export the messages"""
+    if not completed:
+        scrape.say("\nStopped before the end" if STOPPING.is_set() else "\nStopped on a failed request", "red")
+        save_checkpoint(scrape, announce=True)
+    elif scrape.checkpoint is not None:
+        scrape.checkpoint.clear()
     
-    if "inbox" not in r:
-        print(colored("\nError: Could not fetch inbox", "red"))
-        if "message" in r:
-            print(colored(f"Instagram says: {r['message']}", "yellow"))
+    scrape.done = True
+    scrape.completed = completed
+    METRICS.thread_finished(scrape.thread_id)
+    if CURSOR_INDEX is not None:
+        CURSOR_INDEX.flush()
+    if STORE is not None and completed:
+        sync_merge(scrape)
+    else:
+        flush_output(scrape)
+
+
+def abandon_scrape(scrape: ThreadScrape):
+    """Checkpoint and export what a scrape has after Ctrl-C or an error cut it off mid-chat"""
+    save_checkpoint(scrape, announce=True)
+    if scrape.current_cursor is not None:  # Paging had started, there are messages to write
+        flush_output(scrape)
+    scrape.done = True
+
+
+def flush_output(scrape: ThreadScrape):
+    """Export whatever the scrape has, also used when a run is interrupted"""
+    if STORE is not None:
+        # --sync exports the whole chat from the store (sync_merge), a partial run would overwrite it with a few pages
+        scrape.say("The export was left as it was, it is written again once the chat is synced completely", "yellow")
         return
+    if scrape.exporter is not None:
+        scrape.exporter.finalize()
+        scrape.exporter = None
+        scrape.say(f"Writing to file completed, file located at {scrape.file_path}", "green")
+    else:
+        print_messages(scrape)
+
+
+def load_checkpoint(scrape: ThreadScrape, thread: dict):
+    """Set up checkpointing, returns True if a previous run was picked up (--resume)"""
+    scrape.checkpoint = Checkpoint(scrape.options.checkpoint_dir, scrape.thread_id)
     
-    threads = r["inbox"]["threads"]
-    threads_dict: dict = {}
+    if not scrape.checkpoint.exists():
+        if scrape.options.resume:
+            scrape.say("No checkpoint found for this thread, starting from the newest message", "yellow")
+        return False
     
-    for thread in threads:
-        thread_id = thread["thread_id"]
-        
-        if thread.get("is_group"):
-            # For group chats, use the thread title
-            name = thread.get('thread_title', "Unknown Group")
-        else:
-            # For 1-on-1 chats, safely get the first user's full name
-            users = thread.get("users", [])
-            # Check if the users list is not empty before indexing
-            if users:
-                # The user object in a deleted account thread will likely have 
-                # '__deleted__' in the full_name, username, or just be missing data.
-                name = users[0].get("full_name", "Unknown")
-            else:
-                name = "Unknown (No User Info)"
-        
-        # ----------------------------------------------------------------------
-        # ADDED LOGIC TO FILTER OUT DELETED ACCOUNTS
-        # ----------------------------------------------------------------------
-        if "__deleted__" not in name:
-            threads_dict[thread_id] = name
-        else:
-            print(colored(f"[INFO] Omitting deleted thread: {name} [{thread_id}]", "yellow"))
+    if not scrape.options.resume:
+        scrape.say("Found a checkpoint from an earlier run, it will be overwritten (use --resume to continue it)", "yellow")
+        return False
+    
+    count, scrape.pages, cursors, next_cursor = scrape.checkpoint.load()
+    scrape.recent_cursors.extend(cursors)
+    for page in batched(scrape.checkpoint.iter_items(), 100):
+        records = [MessageRecord.from_item(item, scrape.options.keep_raw) for item in page]
+        for record in records:
+            scrape.seen.add(record.item_id)
+        keep_messages(scrape, records, from_checkpoint=True)
+    thread["newest_cursor"] = next_cursor
+    scrape.say(f"Resuming after {scrape.pages} pages ({count} messages)", "cyan")
+    return True
+
+
+def sync_prepare(scrape: ThreadScrape):
+    """Look up where the stored copy of the thread ends before paging"""
+    scrape.sync_newest = STORE.newest(scrape.thread_id)
+    if scrape.sync_newest is None:
+        scrape.say("Nothing stored for this thread yet, doing a full fetch", "cyan")
+    else:
+        scrape.say(f"{STORE.count(scrape.thread_id)} messages already stored, only fetching newer ones", "cyan")
+
+
+def sync_merge(scrape: ThreadScrape):
+    """Store the newly fetched messages, then export the merged thread straight from the store"""
+    new_count = STORE.add_items(scrape.thread_id, scrape.messages)
+    scrape.messages = []
+    stored = (MessageRecord.from_item(item, scrape.options.keep_raw) for item in STORE.iter_items(scrape.thread_id, scrape.since, scrape.until))
+    scrape.count = print_messages(scrape, stored)
+    scrape.say(f"Stored {new_count} new messages ({scrape.count} in total)", "cyan")
+
+
+def cached_inbox():
+    """The cached thread index, None if it has to be fetched again"""
+    return None if ARGS.refresh_inbox else INBOX_CACHE.load()
+
+
+def iter_inbox(fresh: bool = False):
+    """Yield every chat's index entry, page by page, following the inbox and then the pending folder.
+
+    Comes from INBOX_CACHE while it is fresh, unless fresh is set. A
+    complete run through the inbox refreshes the cache; a failed one raises
+    RequestFailed after the entries that could be fetched.
+    """
+    cached = None if fresh else cached_inbox()
+    if cached is not None:
+        for entry in cached:
+            INBOX_LISTING[entry["thread_id"]] = entry
+            yield entry
+        return
+    
+    threads = []
+    for entry in CLIENT.iter_threads():
+        threads.append(entry)
+        INBOX_LISTING[entry["thread_id"]] = entry
+        yield entry
+    
+    INBOX_CACHE.save(threads)
+
+
+def fetch_threads():
+    """Get all chats as a {thread_id: title} dict, None if the inbox couldn't be fetched"""
+    try:
+        return {entry["thread_id"]: entry["title"] for entry in iter_inbox()}
+    except RequestFailed:
+        return None
+
+
+def resolve_thread_ids(thread_ids: list):
+    """Replace chat names in thread_ids with their ids, looked up in the thread index.
+
+    Entries that are all digits are taken as ids as they are, so the index
+    is only read when a name was given. Returns None if a name matches no
+    chat or more than one.
+    """
+    if all(thread_id.isdigit() for thread_id in thread_ids):
+        return thread_ids
+    
+    threads = fetch_threads()
+    if threads is None:
+        return None
+    
+    resolved = []
+    for thread_id in thread_ids:
+        if thread_id.isdigit() or thread_id in threads:
+            resolved.append(thread_id)
+            continue
+        matches = [tid for tid, title in threads.items() if title.lower() == thread_id.lower()]
+        if len(matches) != 1:
+            problem = "No chat is" if not matches else f"{len(matches)} chats are"
+            print(colored(f"Error: {problem} called \"{thread_id}\"", "red"))
+            return None
+        resolved.append(matches[0])
+    return resolved
+
+
+def get_threads():
+    """Print a list of all chats, as the inbox pages come in"""
+    print(colored("Fetching your chats...", "cyan"))
     
-    # Print the available threads after successfully processing all of them
     print(colored("\n=== Available Threads ===", "green"))
     print(colored("\n|      Name         |       ID      |", "cyan"))
-    for thread_id, name in threads_dict.items():
-        print(f"{name} [{thread_id}]")
-    print(colored(f"\nTotal: {len(threads_dict)} threads\n", "green"))
+    total = 0
+    try:
+        for entry in iter_inbox():
+            pending = " (request)" if entry["pending"] else ""
+            print(f"{entry['title']} [{entry['thread_id']}]{pending}")
+            total += 1
+    except RequestFailed:
+        print(colored(f"\nListed {total} threads before the inbox stopped responding\n", "red"))
+        return
+    print(colored(f"\nTotal: {total} threads\n", "green"))
     
 
-def print_messages(streaming: bool = False):
-    """Print and export fetched messages"""
-    global IS_WAITING
+
+def changed_threads():
+    """The --changed work queue: inbox entries of the chats with new activity since their last scrape, most first.
+
+    Only the inbox is listed, no thread page is requested. The listing is
+    always fetched, the cached one may be older than the activity it has to
+    catch (it is refreshed on the way). None if the inbox couldn't be read
+    to the end.
+    """
+    try:
+        entries = list(iter_inbox(fresh=True))
+    except RequestFailed:
+        print(colored("Error: The inbox could not be read to the end", "red"))
+        return None
+    queue = INBOX_SNAPSHOT.changes(entries)
+    print(colored(f"{len(queue)} of {len(entries)} chats have new activity", "cyan"))
+    return queue
+
+
+def list_changes():
+    """Print the --changed work queue in the order it would be scraped"""
+    print(colored("Fetching your chats...", "cyan"))
+    queue = changed_threads()
+    if not queue:
+        return
+    print()
+    for entry in queue:
+        activity = entry["activity"]
+        if activity["new_chat"]:
+            what = "never scraped"
+        else:
+            what = f"{activity['new_items']}{'+' if activity['more'] else ''} new messages"
+        pending = " (request)" if entry["pending"] else ""
+        print(f"{entry['title']} [{entry['thread_id']}]{pending}: {what}")
+
+
+def mark_scraped():
+    """Move the inbox snapshot markers of the chats scraped completely this run (that were in an inbox listing)"""
+    if OPTIONS.until is not None:  # A window ending in the past says nothing about the newest messages
+        return
+    marked = 0
+    for scrape in SCRAPES:
+        entry = INBOX_LISTING.get(scrape.thread_id)
+        if scrape.completed and entry is not None:
+            INBOX_SNAPSHOT.mark(entry)
+            marked += 1
+    if marked:
+        INBOX_SNAPSHOT.save()
+
+
+def archive_threads(thread_ids: list):
+    """Scrape several chats at once on a bounded worker pool.
+
+    Every chat gets its own ThreadScrape and output file, while all workers
+    share CLIENT and its rate governor, so the account-wide request budget
+    holds no matter how many workers run. On Ctrl-C the chats that haven't
+    started are dropped and the running ones stop after their current page,
+    saving a checkpoint, before the interrupt goes on to force_exit().
+    """
+    os.makedirs(ARGS.output_dir, exist_ok=True)
+    scrapes = [ThreadScrape(thread_id, OPTIONS, os.path.join(ARGS.output_dir, f"{thread_id}.{EXPORT_FORMATS[OPTIONS.export_format]}"),
+                            label=thread_id)
+               for thread_id in thread_ids]
+    SCRAPES.extend(scrapes)
+    failed = []
     
-    if not streaming:
-        IS_WAITING = False
-        print("\n----------- Messages -----------")
-        
-        # 1. Prepare all output lines in memory
-        output_lines = []
+    with ThreadPoolExecutor(max_workers=max(1, ARGS.workers)) as pool:
+        futures = {pool.submit(start, scrape): scrape for scrape in scrapes}
+        try:
+            for future in as_completed(futures):
+                scrape = futures[future]
+                try:
+                    if not future.result():
+                        failed.append(scrape)
+                except Exception as e:
+                    scrape.say(f"Error: {str(e)}", "red")
+                    abandon_scrape(scrape)
+                    failed.append(scrape)
+        except KeyboardInterrupt:
+            STOPPING.set()
+            pool.shutdown(wait=False, cancel_futures=True)
+            for future, scrape in futures.items():
+                if future.cancelled():
+                    scrape.done = True  # Never started, nothing to save
+            raise  # Leaving the with block waits for the running chats
+    
+    if failed:
+        print(colored(f"\n{len(failed)} of {len(scrapes)} chats did not finish: "
+                      f"{', '.join(scrape.thread_id for scrape in failed)}", "red"))
+
+
+def poll_newest(scrape: ThreadScrape, catch_up: bool):
+    """Fetch a live chat's messages that weren't shown yet, newest first. None if the request failed.
+
+    If every message on the newest page is new, more may have arrived than
+    fit on one page; with catch_up, older pages are then followed (at most
+    STREAM_CATCH_UP_PAGES) until one reaches a message that was seen before.
+    """
+    new: list = []
+    cursor = ""
+    for _ in range(STREAM_CATCH_UP_PAGES):
+        try:
+            items = get_messages(scrape, cursor)
+        except RateLimited:
+            if new:  # Their ids are already marked as seen, they have to be shown now
+                return new
+            raise
+        if items is None:
+            return new or None
         
-        for mensagem in reverse_list(MESSAGES):
-            name = f"{MEMBERS.get(mensagem['user_id'], 'Unknown')}: " if mensagem.get("user_id") in MEMBERS else "You: "
-            texto = format_message(mensagem)
-            timestamp = datetime.fromtimestamp(float(mensagem["timestamp"]) / 1000000)
+        page_new = [MessageRecord.from_item(item, scrape.options.keep_raw) for item in items if scrape.seen.add(item["item_id"])]
+        METRICS.page(scrape.thread_id, len(page_new))
+        new.extend(page_new)
+        if not catch_up or len(page_new) < len(items) or not has_prev_cursor(scrape.last_response):
+            break
+        cursor = get_prev_cursor(scrape.last_response)
+    
+    return new
+
+
+def show_new_messages(scrape: ThreadScrape, records: list, console: LineRenderer, f=None):
+    """Print (and append to f) the new messages of a live chat, given newest first"""
+    records = records[::-1]
+    sys.stdout.write("".join(console(mensagem) + "\n" for mensagem in records))
+    sys.stdout.flush()
+    if f is not None:
+        f.write("".join(render_message(scrape, mensagem) + "\n" for mensagem in records))
+        f.flush()
+    scrape.count += len(records)
+    if MEDIA is not None:
+        MEDIA.add(scrape.thread_id, records)
+    if SEARCH is not None:
+        SEARCH.add([export_row(scrape, mensagem) for mensagem in records])
+
+
+def stream_threads(thread_ids: list):
+    """Live-tail chats until Ctrl-C, printing new messages as they arrive.
+
+    Only the newest page of each chat is polled. Chats wait in a heap keyed
+    by their next poll time and each has its own PollInterval, so busy chats
+    are polled every few seconds and idle ones about once a minute, while
+    CLIENT's rate governor keeps the total within the account's budget.
+    Nothing piles up over time: messages are printed (and appended to -o)
+    instead of kept, and each chat only remembers a bounded window of ids.
+    A failed poll (even the first one, or 429s that outlast the retries)
+    only backs that chat off, the others go on.
+    """
+    window = OPTIONS.dedup_window or DEFAULT_STREAM_WINDOW
+    scrapes = [ThreadScrape(thread_id, OPTIONS, OPTIONS.file_path, label=thread_id if len(thread_ids) > 1 else None)
+               for thread_id in thread_ids]
+    intervals = [PollInterval(ARGS.poll_min, ARGS.poll_max) for _ in scrapes]
+    color = color_enabled(sys.stdout)
+    consoles = []
+    for scrape in scrapes:
+        scrape.seen = SeenIndex(window)
+        tag = f"[{scrape.label}] " if scrape.label else ""
+        scrape.renderer = LineRenderer(scrape.members, OPTIONS.line_template, prefix=tag)
+        consoles.append(LineRenderer(scrape.members, OPTIONS.line_template, color=color, prefix=tag))
+    
+    schedule = [(0.0, index) for index in range(len(scrapes))]
+    f = open(OPTIONS.file_path, "a", encoding="UTF-8") if OPTIONS.file_path is not None else None
+    print(colored(f"Streaming {len(scrapes)} chat(s), press Ctrl-C to stop\n", "cyan"))
+    try:
+        while schedule:
+            due, index = heapq.heappop(schedule)
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
             
-            output = f"{name}{texto} [{timestamp.strftime('%d/%m/%Y @ %H:%M:%S')}]"
+            scrape = scrapes[index]
+            first = scrape.last_response is None
+            try:
+                new = poll_newest(scrape, catch_up=not first)
+            except (RateLimited, RequestFailed) as e:
+                scrape.say(f"Error: {str(e)}", "red")
+                new = None
+            if new is None:
+                wait = intervals[index].update(0)
+                if first:
+                    scrape.say(f"Unable to access thread, trying again in {wait:.0f}s", "red")
+                heapq.heappush(schedule, (time.monotonic() + wait, index))
+                continue
+            if first:
+                # The messages already in the chat are only marked as seen
+                for user in scrape.last_response["thread"].get("users", []):
+                    scrape.members[user["pk"]] = user["full_name"].split(" ")[0]
+                new = []
+            elif new:
+                show_new_messages(scrape, new, consoles[index], f)
             
-            # Add to list for bulk writing
-            output_lines.append(output)
+            heapq.heappush(schedule, (time.monotonic() + intervals[index].update(len(new or [])), index))
+    except KeyboardInterrupt:
+        pass
+    finally:
+        if f is not None:
+            f.close()
+    
+    print(colored(f"\nStopped streaming: {sum(scrape.count for scrape in scrapes)} new messages "
+                  f"in {METRICS.requests} requests", "cyan"))
+
+
+async def async_get_page(session, scrape: ThreadScrape, cursor: str = ""):
+    """get_page() for the asyncio engine"""
+    return await CLIENT.get_page_async(session, scrape.thread_id, cursor, scrape.options.keep_raw)
+
+
+async def async_iter_pages(session, scrape: ThreadScrape, cursor: str | None):
+    """iter_pages() for the asyncio engine"""
+    try:
+        async for cursor, response in CLIENT.iter_pages_async(session, scrape.thread_id, cursor, scrape.options.keep_raw, last_page(scrape)):
+            scrape.last_response = response
+            yield cursor, response["thread"].get("items", []), response
+    except RequestFailed as e:
+        page_failed(scrape, e.response)
+        yield e.cursor, None, None
+
+
+async def async_prefetched(pages, depth: int):
+    """prefetched() for the asyncio engine, the fetcher is a task instead of a thread"""
+    if depth <= 0:
+        async for page in pages:
+            yield page
+        return
+    
+    ready = asyncio.Queue(maxsize=depth)
+    
+    async def fetch():
+        try:
+            async for page in pages:
+                await ready.put(page)
+            await ready.put(_END)
+        except Exception as e:
+            await ready.put(e)
+    
+    fetcher = asyncio.create_task(fetch())
+    try:
+        while (entry := await ready.get()) is not _END:
+            if isinstance(entry, BaseException):
+                raise entry
+            yield entry
+    finally:
+        fetcher.cancel()
+
+
+async def async_get_all_messages(session, scrape: ThreadScrape, thread: dict, prefetch: int = DEFAULT_PREFETCH):
+    """get_all_messages() for the asyncio engine"""
+    pages = async_prefetched(async_iter_pages(session, scrape, thread.get('newest_cursor')), prefetch)
+    try:
+        async for cursor, items, response in pages:
+            scrape.current_cursor = cursor
+            if items is None:
+                return False
+            if not items:
+                break
             
-            # Print to console
-            if FILE_PATH is None or VERBOSE:
-                print(f"{colored(name, 'yellow')}{texto} [{timestamp.strftime('%d/%m/%Y @ %H:%M:%S')}]")
-
-        # 2. Write all messages to file in a single operation
-        if FILE_PATH is not None:
-            # Use 'w' mode here to overwrite the file with the complete, final list
-            # Note: This relies on the file being cleaned up (or not) before start()
-            with open(FILE_PATH, 'w', encoding="UTF-8") as f:
-                f.write("\n".join(output_lines) + "\n")
-            print(colored(f"Writing to file completed, file located at {FILE_PATH}", "green"))
-
-
-def format_message(msg):
-    """Format message based on type"""
-    item_type = msg.get('item_type', '')
-    
-    if item_type == 'text':
-        return msg.get('text', '')
-    
-    elif item_type == 'media':
-        media_type = msg.get('media', {}).get('media_type')
-        if media_type == 1:
-            url = msg['media']['image_versions2']['candidates'][0]['url']
-            return f"Photo: {url}"
-        elif media_type == 2:
-            url = msg['media']['video_versions'][0]['url']
-            return f"Video: {url}"
-    
-    elif item_type == 'media_share':
+            # Exporting, indexing and checkpointing block, keep them off the event loop
+            if await asyncio.to_thread(take_page, scrape, cursor, items, response) is None:
+                break
+    finally:
+        await pages.aclose()
+    
+    scrape.current_cursor = None
+    return True
+
+
+async def async_start(session, scrape: ThreadScrape):
+    """start() for the asyncio engine"""
+    scrape.say("Connecting to Instagram...", "cyan")
+    resposta = await async_get_page(session, scrape)
+    
+    thread = await asyncio.to_thread(begin_scrape, scrape, resposta)
+    if thread is None:
+        return False
+    
+    completed = await async_get_all_messages(session, scrape, thread, scrape.options.prefetch)
+    await asyncio.to_thread(end_scrape, scrape, completed)
+    return completed
+
+
+async def async_fetch_threads(session):
+    """fetch_threads() for the asyncio engine"""
+    threads = cached_inbox()
+    if threads is None:
         try:
-            user = msg['media_share']['user']['username']
-            name = msg['media_share']['user']['full_name']
-            code = msg['media_share']['code']
-            return f"Post share from {user} (A.K.A {name}): https://instagram.com/p/{code}/"
-        except KeyError:
-            return "Post share: Unable to get post"
-    
-    elif item_type == 'voice_media':
-        url = msg['voice_media']['media']['audio']['audio_src']
-        return f"Voice message: {url}"
-    
-    elif item_type == 'raven_media':
-        media_type = msg.get('visual_media', {}).get('media', {}).get('media_type')
-        if media_type == 1:
-            try:
-                url = msg['visual_media']['media']['image_versions2']['candidates'][0]['url']
-                return f"Temporary photo: {url} (May be expired)"
-            except KeyError:
-                return "Temporary photo: Unable to fetch (Expired)"
-        elif media_type == 2:
+            threads = [entry async for entry in CLIENT.iter_threads_async(session)]
+        except RequestFailed:
+            return None
+        INBOX_CACHE.save(threads)
+    
+    INBOX_LISTING.update((entry["thread_id"], entry) for entry in threads)
+    return {entry["thread_id"]: entry["title"] for entry in threads}
+
+
+async def async_archive(thread_ids: list | None):
+    """Run every chat's scrape as a task on one event loop.
+
+    thread_ids None means every chat in the inbox. At most ARGS.workers chats
+    are paged at the same time. When the run is cancelled (Ctrl-C) each
+    running chat saves its checkpoint and writes what it has before the
+    cancellation goes on.
+    """
+    async with open_async_session(SESSIONID, API_HEADERS, pool_size=ARGS.pool_size, read_timeout=ARGS.timeout) as session:
+        if thread_ids is None:
+            print(colored("Fetching your chats...", "cyan"))
+            threads_dict = await async_fetch_threads(session)
+            if threads_dict is None:
+                return
+            thread_ids = list(threads_dict)
+        
+        if len(thread_ids) == 1:
+            SCRAPES.append(ThreadScrape(thread_ids[0], OPTIONS, OPTIONS.file_path))
+        else:
+            os.makedirs(ARGS.output_dir, exist_ok=True)
+            SCRAPES.extend(ThreadScrape(thread_id, OPTIONS, os.path.join(ARGS.output_dir, f"{thread_id}.{EXPORT_FORMATS[OPTIONS.export_format]}"),
+                                        label=thread_id) for thread_id in thread_ids)
+        
+        slots = asyncio.Semaphore(max(1, ARGS.workers))
+        
+        async def run(scrape: ThreadScrape):
             try:
-                url = msg['visual_media']['media']['video_versions'][0]['url']
-                return f"Temporary video: {url} (May be expired)"
-            except KeyError:
-                return "Temporary video: Unable to fetch (Expired)"
+                async with slots:
+                    return await async_start(session, scrape)
+            except asyncio.CancelledError:
+                if not scrape.done:
+                    abandon_scrape(scrape)
+                raise
+            except Exception as e:
+                scrape.say(f"Error: {str(e)}", "red")
+                await asyncio.to_thread(abandon_scrape, scrape)
+                return False
+        
+        results = await asyncio.gather(*(run(scrape) for scrape in SCRAPES))
+    
+    failed = [scrape.thread_id for scrape, completed in zip(SCRAPES, results) if not completed]
+    if failed and len(SCRAPES) > 1:
+        print(colored(f"\n{len(failed)} of {len(SCRAPES)} chats did not finish: {', '.join(failed)}", "red"))
+
+
+def print_messages(scrape: ThreadScrape, items=None):
+    """Print and export fetched messages, returns how many were written.
+
+    items defaults to the scrape's messages; any iterable of items in
+    chronological order works, lines are written as they are rendered.
+    """
+    if items is None:
+        items = reversed(scrape.messages)
+    if scrape.options.export_format != "text" and scrape.file_path is not None:
+        return export_messages(scrape, items)
+    
+    console = ConsoleWriter(scrape.options.pager) if scrape.file_path is None or scrape.options.verbose else None
+    if console is not None:
+        console.write("\n----------- Messages -----------")
+        console_line = LineRenderer(scrape.members, scrape.options.line_template, color=console.color)
+        tail = deque(maxlen=scrape.options.tail) if scrape.options.tail else None
+    
+    # Use 'w' mode here to overwrite the file with the complete, final list
+    f = open(scrape.file_path, 'w', encoding="UTF-8") if scrape.file_path is not None else None
+    written = 0
+    try:
+        for mensagem in items:
+            if f is not None:
+                f.write(render_message(scrape, mensagem) + "\n")
+            if console is not None and not console.closed:
+                if tail is not None:
+                    tail.append(mensagem)
+                else:
+                    console.write(console_line(mensagem))
+            written += 1
+        if console is not None and tail is not None:
+            if written > len(tail):
+                console.write(f"(showing the last {len(tail)} of {written} messages)")
+            for mensagem in tail:
+                console.write(console_line(mensagem))
+    finally:
+        if f is not None:
+            f.close()
+        if console is not None:
+            console.close()
     
-    return item_type
+    if f is not None:
+        scrape.say(f"Writing to file completed, file located at {scrape.file_path}", "green")
+    return written
 
 
-def waiting():
-    """Thread to show fetching progress"""
+def export_messages(scrape: ThreadScrape, items):
+    """Write items (chronological) to the scrape's file in its --format, EXPORT_BATCH rows at a time"""
+    exporter = open_export(scrape.file_path, scrape.options.export_format, False)
+    try:
+        for page in batched(items, EXPORT_BATCH):
+            exporter.write_page([export_row(scrape, mensagem) for mensagem in page])
+    finally:
+        exporter.finalize()
+    
+    scrape.say(f"Writing to file completed, file located at {scrape.file_path}", "green")
+    return exporter.lines
+
+
+def export_row(scrape: ThreadScrape, mensagem: MessageRecord) -> tuple:
+    """The normalized fields (export.EXPORT_FIELDS) of one message"""
+    sender = scrape.members.get(mensagem.user_id, "You")
+    return (mensagem.item_id, scrape.thread_id, mensagem.user_id, sender, mensagem.item_type,
+            mensagem.text, mensagem.url, mensagem.timestamp)
+
+
+def render_message(scrape: ThreadScrape, mensagem: MessageRecord) -> str:
+    """The exported line of one message"""
+    if scrape.renderer is None:
+        scrape.renderer = LineRenderer(scrape.members, scrape.options.line_template)
+    return scrape.renderer(mensagem)
+
+
+def search_messages():
+    """Print the messages in the search index matching --search and the filters, newest first"""
+    if not os.path.isfile(ARGS.search_index):
+        print(colored(f"Error: No search index at {ARGS.search_index}, scrape some chats with --index first", "red"))
+        return
+    index = SearchIndex(ARGS.search_index)
+    thread_ids = [thread_id.strip() for thread_id in ARGS.threadid.split(",") if thread_id.strip()] if ARGS.threadid else None
+    since = int(OPTIONS.since.timestamp() * 1000000) if OPTIONS.since is not None else None
+    until = int(OPTIONS.until.timestamp() * 1000000) if OPTIONS.until is not None else None
+    
+    started = time.perf_counter()
+    try:
+        rows = index.search(ARGS.search, ARGS.sender, thread_ids, ARGS.item_type, since, until, ARGS.search_limit)
+    except sqlite3.OperationalError as e:
+        print(colored(f"Error: Invalid search query ({e})", "red"))
+        return
+    finally:
+        index.close()
+    elapsed = time.perf_counter() - started
+    
+    members: dict = {}
+    with ConsoleWriter(OPTIONS.pager) as console:
+        line = LineRenderer(members, OPTIONS.line_template, color=console.color)
+        for row in rows:
+            members[row["sender_id"]] = row["sender"]
+            record = MessageRecord(row["item_id"], row["sender_id"], row["timestamp"], row["type"], row["text"], row["url"])
+            console.write(f"[{row['thread_id']}] {line(record)}")
+        more = " (raise --search-limit to see more)" if len(rows) == ARGS.search_limit else ""
+        console.write(f"\n{len(rows)} messages found in {elapsed * 1000:.1f} ms{more}")
+
+
+def read_archive():
+    """Print (or write to -o) the messages of --read-archive between --since and --until, oldest first"""
+    try:
+        archive = ArchiveReader(ARGS.read_archive)
+    except (FileNotFoundError, RuntimeError) as e:
+        print(colored(f"Error: {e}", "red"))
+        return
+    since = int(OPTIONS.since.timestamp() * 1000000) if OPTIONS.since is not None else None
+    until = int(OPTIONS.until.timestamp() * 1000000) if OPTIONS.until is not None else None
+    
+    members: dict = {}
+    f = open(ARGS.output, "w", encoding="UTF-8") if ARGS.output is not None else None
+    console = ConsoleWriter(OPTIONS.pager) if f is None else None
+    line = LineRenderer(members, OPTIONS.line_template, color=console is not None and console.color)
+    try:
+        positions = archive.span(since, until)
+        if OPTIONS.tail:
+            positions = positions[-OPTIONS.tail:]  # Straight from the index, nothing before is read
+        for item_id, _, sender_id, sender, item_type, text, url, timestamp in archive.read(positions):
+            members[sender_id] = sender
+            rendered = line(MessageRecord(item_id, sender_id, timestamp, item_type, text, url))
+            if f is not None:
+                f.write(rendered + "\n")
+            else:
+                console.write(rendered)
+    finally:
+        archive.close()
+        if f is not None:
+            f.close()
+        if console is not None:
+            console.close()
+    
+    if f is not None:
+        print(colored(f"Writing to file completed, file located at {ARGS.output}", "green"))
+
+
+def finish_media():
+    """Wait for the media downloads still queued, then report on them"""
+    if MEDIA.pending():
+        print(colored(f"\nWaiting for {MEDIA.pending()} media downloads...", "cyan"))
+    MEDIA.close()
+    
+    print(colored(f"Media: {MEDIA.downloaded} downloaded ({MEDIA.duplicates} already stored) into {MEDIA.directory}", "cyan"))
+    if MEDIA.failed:
+        print(colored(f"{len(MEDIA.failed)} media downloads failed (expired links are common for temporary media)", "yellow"))
+        if OPTIONS.verbose:
+            for item_id, reason in MEDIA.failed:
+                print(colored(f"[DEBUG] {item_id}: {reason}", "yellow"))
+
+
+def monitor():
+    """Thread that shows fetching progress and keeps the --stats-file up to date, all read from METRICS"""
+    last_write = 0.0
     try:
         while IS_WAITING:
-            if not VERBOSE:
-                hours = int(((TOTAL_TIME / 1000) / 3600) % 24)
-                minutes = int(((TOTAL_TIME / 1000) / 60) % 60)
-                seconds = int((TOTAL_TIME / 1000) % 60)
-                dots = '.' * ((int(TOTAL_TIME / 1000) % 3) + 1)
+            running = [scrape for scrape in SCRAPES if not scrape.done]
+            if not OPTIONS.verbose and running:
+                elapsed = int(METRICS.elapsed())
+                dots = '.' * ((elapsed % 3) + 1)
                 spaces = ' ' * (4 - len(dots))
-                rate = RATE[-1] if RATE else 0
-                print(f"Fetching messages{dots}{spaces}({hours}h{minutes}m{seconds}s) ({len(MESSAGES)} messages in {REQUESTS_AMMOUNT} requests) (Rate: {rate:.2f} msg/s)", end="\r")
+                messages = sum(scrape.count for scrape in SCRAPES)
+                chats = f" ({len(SCRAPES) - len(running)}/{len(SCRAPES)} chats done)" if len(SCRAPES) > 1 else ""
+                print(f"Fetching messages{dots}{spaces}({format_duration(elapsed)}) ({messages} messages in {METRICS.requests} requests) (Rate: {METRICS.message_rate():.2f} msg/s){chats}", end="\r")
+            
+            if ARGS.stats_file and time.monotonic() - last_write >= ARGS.stats_interval:
+                METRICS.write(ARGS.stats_file)
+                last_write = time.monotonic()
             time.sleep(1)
     except KeyboardInterrupt:
         pass
 
 
-def compute_average_rate():
-    return sum(RATE) / len(RATE) if RATE else 0
+def start_monitor():
+    monitor_thread = threading.Thread(target=monitor, daemon=True)
+    monitor_thread.start()
+
+
+def format_duration(seconds: float) -> str:
+    seconds = int(seconds)
+    return f"{seconds // 3600}h{(seconds // 60) % 60}m{seconds % 60}s"
 
 
 def main():
-    global THREADID, SESSIONID, ARGS, VERBOSE, LIMIT_DATE
+    global SESSIONID, ARGS, CURSOR_INDEX
     
     ARGS = PARSER.parse_args()
     
@@ -465,79 +1409,149 @@ def main():
             if not success:
                 print(colored(f"Error: {message}", "red"))
                 return
+            if ARGS.metrics_port:
+                serve_metrics(METRICS, ARGS.metrics_port)
+                print(colored(f"Metrics at http://127.0.0.1:{ARGS.metrics_port}/metrics", "cyan"))
             
             if message == "list":
-                get_threads()
+                if ARGS.changed:
+                    list_changes()
+                else:
+                    get_threads()
+            elif message == "search":
+                search_messages()
+            elif message == "read_archive":
+                read_archive()
             elif message == "stream":
-                print(colored("Stream mode not fully implemented in this version", "yellow"))
+                if ARGS.all_threads:
+                    threads_dict = fetch_threads()
+                    if threads_dict is None:
+                        return
+                    thread_ids = list(threads_dict)
+                else:
+                    thread_ids = resolve_thread_ids([thread_id.strip() for thread_id in OPTIONS.thread_id.split(",") if thread_id.strip()])
+                    if thread_ids is None:
+                        return
+                start_monitor()
+                stream_threads(thread_ids)
+            elif ARGS.use_async:
+                start_monitor()
+                
+                if ARGS.all_threads:
+                    thread_ids = None
+                    if ARGS.changed:
+                        queue = changed_threads()
+                        if not queue:
+                            return
+                        thread_ids = [entry["thread_id"] for entry in queue]
+                else:
+                    thread_ids = resolve_thread_ids([thread_id.strip() for thread_id in OPTIONS.thread_id.split(",") if thread_id.strip()])
+                    if thread_ids is None:
+                        return
+                asyncio.run(async_archive(thread_ids))
+            elif message == "bulk":
+                if ARGS.all_threads:
+                    print(colored("Fetching your chats...", "cyan"))
+                    if ARGS.changed:
+                        queue = changed_threads()
+                        if not queue:
+                            return
+                        thread_ids = [entry["thread_id"] for entry in queue]
+                    else:
+                        threads_dict = fetch_threads()
+                        if threads_dict is None:
+                            return
+                        thread_ids = list(threads_dict)
+                else:
+                    thread_ids = resolve_thread_ids([thread_id.strip() for thread_id in OPTIONS.thread_id.split(",") if thread_id.strip()])
+                    if thread_ids is None:
+                        return
+                
+                print(colored(f"Archiving {len(thread_ids)} chats with {ARGS.workers} workers into {ARGS.output_dir}\n", "cyan"))
+                start_monitor()
+                
+                archive_threads(thread_ids)
             else:
-                if VERBOSE:
+                if OPTIONS.verbose:
                     print("Starting in verbose mode...")
                 
-                waiting_thread = threading.Thread(target=waiting, daemon=True)
-                waiting_thread.start()
+                thread_ids = resolve_thread_ids([OPTIONS.thread_id])
+                if thread_ids is None:
+                    return
+                OPTIONS.thread_id = thread_ids[0]
+                
+                SCRAPES.append(ThreadScrape(OPTIONS.thread_id, OPTIONS, OPTIONS.file_path))
+                start_monitor()
                 
-                start()
+                start(SCRAPES[0])
         else:
             # Interactive mode
             print(colored("=== Instagram DM Scraper ===\n", "cyan"))
             SESSIONID = input("Your account's Sessionid: ")
+            init_client()
             
             check_threads = input("See chats list (y/N): ").lower()
             if check_threads == "y":
                 get_threads()
             
-            THREADID = input("Chat's Threadid: ")
+            OPTIONS.thread_id = input("Chat's Threadid: ")
             
             enable_verbose = input("Verbose (y/N): ").lower()
-            VERBOSE = (enable_verbose == "y")
+            OPTIONS.verbose = (enable_verbose == "y")
+            CLIENT.verbose = OPTIONS.verbose
             
             enable_export = input("Export to file (y/N): ").lower()
             if enable_export == "y":
-                FILE_PATH = input("File path + name: ")
-                if os.path.isfile(FILE_PATH):
+                OPTIONS.file_path = input("File path + name: ")
+                if os.path.isfile(OPTIONS.file_path):
                     print(colored("Entered path is a file, continuing", "green"))
-                elif not os.path.exists(FILE_PATH):
+                elif not os.path.exists(OPTIONS.file_path):
                     print(colored("Could not find the entered file path...", "yellow"))
                     create_file = input("Entered file does not exist, create it (y/N)? ")
                     if create_file == "y":
-                        with open(FILE_PATH, "w") as file:
+                        with open(OPTIONS.file_path, "w") as file:
                             file.write("")
                     else:
                         print(colored("Saving to file omitted.", "red"))
+                        OPTIONS.file_path = None
             
             temp_limit_date = input("Limit date (dd/mm/yyyy[@hh:mm:ss]): ")
             if temp_limit_date:
-                if "@" in temp_limit_date:
-                    LIMIT_DATE = datetime.strptime(temp_limit_date, "%d/%m/%Y@%H:%M:%S")
-                else:
-                    LIMIT_DATE = datetime.strptime(temp_limit_date, "%d/%m/%Y")
+                OPTIONS.since = parse_date(temp_limit_date)
             
-            waiting_thread = threading.Thread(target=waiting, daemon=True)
-            waiting_thread.start()
-            start()
+            CURSOR_INDEX = CursorIndex(ARGS.cursor_index)
+            SCRAPES.append(ThreadScrape(OPTIONS.thread_id, OPTIONS, OPTIONS.file_path))
+            start_monitor()
+            start(SCRAPES[0])
         
         # Print summary
-        if not ARGS.list and not ARGS.stream:
-            hours = int(((TOTAL_TIME / 1000) / 3600) % 24)
-            minutes = int(((TOTAL_TIME / 1000) / 60) % 60)
-            seconds = int((TOTAL_TIME / 1000) % 60)
-            avg_rate = compute_average_rate()
+        if SCRAPES:
+            mark_scraped()
+            elapsed = int(METRICS.elapsed())
+            hours, minutes, seconds = elapsed // 3600, (elapsed // 60) % 60, elapsed % 60
             
             print(colored("\n✓ Fetching complete!", "green"))
-            print(colored(f"Total messages: {len(MESSAGES)}", "cyan"))
+            if len(SCRAPES) > 1:
+                print(colored(f"Chats: {len(SCRAPES)}", "cyan"))
+            print(colored(f"Total messages: {sum(scrape.count for scrape in SCRAPES)}", "cyan"))
             print(colored(f"Time elapsed: {hours}h {minutes}m {seconds}s", "cyan"))
-            print(colored(f"API requests: {REQUESTS_AMMOUNT}", "cyan"))
-            print(colored(f"Average rate: {avg_rate:.2f} messages/second", "cyan"))
+            cached = f" ({METRICS.cache_hits} pages from the page cache)" if METRICS.cache_hits else ""
+            print(colored(f"API requests: {METRICS.requests}{cached}", "cyan"))
+            print(colored(f"Average rate: {METRICS.message_rate():.2f} messages/second", "cyan"))
+        
+        if MEDIA is not None:
+            finish_media()
+        if ARGS.stats_file:
+            METRICS.write(ARGS.stats_file)
     
     except KeyboardInterrupt:
         force_exit()
     except Exception as e:
         print(colored(f"\nUnexpected error: {str(e)}", "red"))
-        if VERBOSE:
+        if OPTIONS.verbose:
             traceback.print_exc()
         force_exit()
 
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    main()
@@ -0,0 +1,163 @@
+import hashlib
+import itertools
+import json
+import os
+import queue
+import threading
+import time
+from urllib.parse import urlparse
+
+import requests
+from requests.adapters import HTTPAdapter
+
+DEFAULT_MEDIA_DIR = "media"
+DEFAULT_MEDIA_WORKERS = 4
+MEDIA_TYPES = ("media", "voice_media", "raven_media")
+MEDIA_RETRIES = 3
+CHUNK_SIZE = 256 * 1024
+DOWNLOAD_TIMEOUT = (10, 60)
+
+_STOP = (2, 0, None, None)  # Sorts after every real job
+
+
+class MediaDownloader:
+    """Downloads the media of fetched messages while pagination goes on.
+
+    Messages are queued with add() as pages come in; a bounded pool of
+    worker threads streams each file to disk in chunks. Temporary (raven)
+    media is taken from the queue first since its URLs expire soonest.
+
+    A download goes to .partial/<item_id>.part and is continued with a Range
+    request if an earlier attempt (or run) stopped partway. Finished files
+    are named after their SHA-256, so media sent to several chats is only
+    stored once. manifest.jsonl maps every item_id to its file, and items
+    already in it are skipped.
+    """
+
+    def __init__(self, directory: str = DEFAULT_MEDIA_DIR, workers: int = DEFAULT_MEDIA_WORKERS,
+                 user_agent: str | None = None):
+        self.directory = directory
+        self.partial_dir = os.path.join(directory, ".partial")
+        self.manifest_path = os.path.join(directory, "manifest.jsonl")
+        os.makedirs(self.partial_dir, exist_ok=True)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=workers, pool_maxsize=workers)
+        self.session.mount("https://", adapter)
+        self.session.mount("http://", adapter)
+        if user_agent:
+            self.session.headers["user-agent"] = user_agent
+
+        self.downloaded = 0
+        self.duplicates = 0  # Finished downloads whose content was already stored
+        self.failed: list = []  # (item_id, reason)
+        self._done = self._load_manifest()
+        self._queued: set = set()
+        self._lock = threading.Lock()
+        self._order = itertools.count()
+        self._queue: queue.PriorityQueue = queue.PriorityQueue()
+        self._workers = [threading.Thread(target=self._work, daemon=True) for _ in range(max(1, workers))]
+        for worker in self._workers:
+            worker.start()
+
+    def _load_manifest(self) -> set:
+        done = set()
+        if os.path.isfile(self.manifest_path):
+            with open(self.manifest_path, encoding="UTF-8") as f:
+                for line in f:
+                    try:
+                        done.add(json.loads(line)["item_id"])
+                    except (ValueError, KeyError):
+                        continue  # Torn last line of an interrupted run
+        return done
+
+    def add(self, thread_id: str, records: list):
+        """Queue the media of some MessageRecords, skipping ones that are done or already queued"""
+        with self._lock:
+            for record in records:
+                if record.item_type not in MEDIA_TYPES or record.url is None:
+                    continue
+                if record.item_id in self._done or record.item_id in self._queued:
+                    continue
+                self._queued.add(record.item_id)
+                priority = 0 if record.item_type == "raven_media" else 1
+                self._queue.put((priority, next(self._order), thread_id, record))
+
+    def pending(self) -> int:
+        return self._queue.qsize()
+
+    def close(self):
+        """Wait for the queued downloads to finish and stop the workers"""
+        for _ in self._workers:
+            self._queue.put(_STOP)
+        for worker in self._workers:
+            worker.join()
+        self.session.close()
+
+    def _work(self):
+        while True:
+            job = self._queue.get()
+            if job[3] is None:
+                return
+            _, _, thread_id, record = job
+            try:
+                self._download(thread_id, record)
+            except Exception as e:
+                with self._lock:
+                    self.failed.append((record.item_id, str(e)))
+
+    def _download(self, thread_id: str, record):
+        part_path = os.path.join(self.partial_dir, f"{record.item_id}.part")
+        for attempt in range(MEDIA_RETRIES):
+            try:
+                digest, size = self._fetch(record.url, part_path)
+                break
+            except (requests.exceptions.Timeout, requests.exceptions.ConnectionError,
+                    requests.exceptions.ChunkedEncodingError):
+                if attempt == MEDIA_RETRIES - 1:
+                    raise
+                time.sleep(2 ** attempt)  # The part file is kept, the next attempt continues it
+
+        path = os.path.join(self.directory, digest[:2], f"{digest}{file_extension(record.url)}")
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with self._lock:
+            if os.path.exists(path):
+                os.remove(part_path)
+                self.duplicates += 1
+            else:
+                os.replace(part_path, path)
+            self.downloaded += 1
+            self._done.add(record.item_id)
+            entry = {"item_id": record.item_id, "thread_id": thread_id, "type": record.item_type,
+                     "file": os.path.relpath(path, self.directory), "sha256": digest, "bytes": size}
+            with open(self.manifest_path, "a", encoding="UTF-8") as f:
+                f.write(json.dumps(entry) + "\n")
+
+    def _fetch(self, url: str, part_path: str):
+        """Stream url into part_path, continuing what is already there. Returns (sha256, size)"""
+        sha = hashlib.sha256()
+        have = os.path.getsize(part_path) if os.path.exists(part_path) else 0
+        if have:
+            with open(part_path, "rb") as f:
+                for chunk in iter(lambda: f.read(CHUNK_SIZE), b""):
+                    sha.update(chunk)
+
+        headers = {"Range": f"bytes={have}-"} if have else {}
+        with self.session.get(url, headers=headers, stream=True, timeout=DOWNLOAD_TIMEOUT) as r:
+            if r.status_code == 416:  # Nothing left to fetch
+                return sha.hexdigest(), have
+            r.raise_for_status()
+            if have and r.status_code != 206:  # Server ignored the range, start over
+                have = 0
+                sha = hashlib.sha256()
+            with open(part_path, "ab" if have else "wb") as f:
+                for chunk in r.iter_content(CHUNK_SIZE):
+                    f.write(chunk)
+                    sha.update(chunk)
+                    have += len(chunk)
+        return sha.hexdigest(), have
+
+
+def file_extension(url: str) -> str:
+    extension = os.path.splitext(urlparse(url).path)[1]
+    return extension if 1 < len(extension) <= 5 else ".bin"
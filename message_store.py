@@ -0,0 +1,74 @@
+import json
+import sqlite3
+import threading
+
+from shared_db import connect_shared
+
+DEFAULT_STORE_PATH = "messages.db"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    thread_id TEXT NOT NULL,
+    item_id TEXT NOT NULL,
+    timestamp INTEGER NOT NULL,
+    item TEXT NOT NULL,
+    PRIMARY KEY (thread_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS messages_by_time ON messages (thread_id, timestamp);
+"""
+
+
+class MessageStore:
+    """Local SQLite store of fetched items, keyed by thread and item_id.
+
+    Used by --sync so later runs only need to page until they reach the
+    newest item that is already stored.
+    """
+
+    def __init__(self, path: str = DEFAULT_STORE_PATH):
+        self.path = path
+        self.conn = connect_shared(path, SCHEMA)
+        self._lock = threading.Lock()
+
+    def newest(self, thread_id: str):
+        """(item_id, timestamp) of the newest stored item of a thread, or None"""
+        with self._lock:
+            return self.conn.execute(
+                "SELECT item_id, timestamp FROM messages WHERE thread_id = ? ORDER BY timestamp DESC LIMIT 1",
+                (thread_id,),
+            ).fetchone()
+
+    def count(self, thread_id: str) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM messages WHERE thread_id = ?", (thread_id,)).fetchone()[0]
+
+    def add_items(self, thread_id: str, items: list) -> int:
+        """Insert MessageRecords not stored yet, returns how many were new"""
+        with self._lock, self.conn:
+            before = self.conn.total_changes
+            self.conn.executemany(
+                "INSERT OR IGNORE INTO messages (thread_id, item_id, timestamp, item) VALUES (?, ?, ?, ?)",
+                ((thread_id, item.item_id, item.timestamp, json.dumps(item.to_dict())) for item in items),
+            )
+            return self.conn.total_changes - before
+
+    def iter_items(self, thread_id: str, since: int | None = None, until: int | None = None):
+        """Stored items (as dicts) of a thread, oldest first, read lazily.
+
+        since and until are timestamps in microseconds, items outside them
+        are left out. Uses its own connection so a long export doesn't hold
+        the lock.
+        """
+        conn = sqlite3.connect(self.path)
+        try:
+            rows = conn.execute(
+                "SELECT item FROM messages WHERE thread_id = ? AND timestamp BETWEEN ? AND ? ORDER BY timestamp",
+                (thread_id, since or 0, until if until is not None else 2 ** 63 - 1),
+            )
+            for (item,) in rows:
+                yield json.loads(item)
+        finally:
+            conn.close()
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,202 @@
+import json
+import threading
+import time
+from bisect import bisect_left
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from checkpoint import atomic_write
+
+LATENCY_BUCKETS = (0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)  # Seconds
+DECODE_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1)
+PREFIX = "igdm"
+
+
+class Histogram:
+    """Fixed-bucket histogram (upper bounds in seconds), not thread-safe on its own"""
+
+    def __init__(self, buckets: tuple):
+        self.buckets = buckets
+        self.counts = [0] * (len(buckets) + 1)  # Last one is +Inf
+        self.total = 0.0
+        self.count = 0
+
+    def observe(self, value: float):
+        self.counts[bisect_left(self.buckets, value)] += 1
+        self.total += value
+        self.count += 1
+
+    def to_dict(self) -> dict:
+        return {"buckets": dict(zip([*map(str, self.buckets), "+Inf"], self.counts)),
+                "sum": self.total, "count": self.count}
+
+
+class ThreadStats:
+    def __init__(self):
+        self.started = time.monotonic()
+        self.finished: float | None = None
+        self.messages = 0
+        self.pages = 0
+        self.requests = 0
+
+    def rate(self) -> float:
+        """Fetched messages per second of wall time since the chat started"""
+        elapsed = (self.finished or time.monotonic()) - self.started
+        return self.messages / elapsed if elapsed > 0 else 0.0
+
+
+class Metrics:
+    """Counters and histograms of one run, shared by every worker.
+
+    Every update takes the lock, so readers (the progress line, the stats
+    file, the HTTP endpoint) always see a consistent snapshot. Message
+    rates are total messages over wall time, per chat and overall.
+    """
+
+    def __init__(self):
+        self.started = time.monotonic()
+        self.responses: dict = {}  # HTTP status: count
+        self.retries: dict = {}  # reason: count
+        self.rate_limited = 0
+        self.bytes_received = 0
+        self.cache_hits = 0  # Thread pages answered by the page cache
+        self.latency = Histogram(LATENCY_BUCKETS)
+        self.decode = Histogram(DECODE_BUCKETS)
+        self.threads: dict = {}  # thread_id: ThreadStats
+        self._lock = threading.Lock()
+
+    def _thread(self, thread_id: str) -> ThreadStats:
+        if thread_id not in self.threads:
+            self.threads[thread_id] = ThreadStats()
+        return self.threads[thread_id]
+
+    def request(self, seconds: float, status: int, size: int, thread_id: str | None = None):
+        """Count a finished HTTP request"""
+        with self._lock:
+            self.responses[status] = self.responses.get(status, 0) + 1
+            if status == 429:
+                self.rate_limited += 1
+            self.bytes_received += size
+            self.latency.observe(seconds)
+            if thread_id is not None:
+                self._thread(thread_id).requests += 1
+
+    def retry(self, reason: str):
+        with self._lock:
+            self.retries[reason] = self.retries.get(reason, 0) + 1
+
+    def cache_hit(self):
+        with self._lock:
+            self.cache_hits += 1
+
+    def decoded(self, seconds: float):
+        with self._lock:
+            self.decode.observe(seconds)
+
+    def page(self, thread_id: str, messages: int):
+        """Count a fetched page of a chat and the new messages on it"""
+        with self._lock:
+            stats = self._thread(thread_id)
+            stats.messages += messages
+            stats.pages += 1
+
+    def thread_finished(self, thread_id: str):
+        with self._lock:
+            self._thread(thread_id).finished = time.monotonic()
+
+    @property
+    def requests(self) -> int:
+        with self._lock:
+            return sum(self.responses.values())
+
+    def elapsed(self) -> float:
+        return time.monotonic() - self.started
+
+    def message_rate(self) -> float:
+        """Fetched messages per second over the whole run"""
+        with self._lock:
+            total = sum(stats.messages for stats in self.threads.values())
+        elapsed = self.elapsed()
+        return total / elapsed if elapsed > 0 else 0.0
+
+    def snapshot(self) -> dict:
+        with self._lock:
+            return {
+                "uptime_seconds": self.elapsed(),
+                "requests": sum(self.responses.values()),
+                "responses": {str(status): count for status, count in sorted(self.responses.items())},
+                "retries": dict(self.retries),
+                "rate_limited": self.rate_limited,
+                "bytes_received": self.bytes_received,
+                "page_cache_hits": self.cache_hits,
+                "request_seconds": self.latency.to_dict(),
+                "json_decode_seconds": self.decode.to_dict(),
+                "threads": {thread_id: {"messages": stats.messages, "pages": stats.pages, "requests": stats.requests,
+                                        "messages_per_second": stats.rate(), "done": stats.finished is not None}
+                            for thread_id, stats in self.threads.items()},
+            }
+
+    def to_prometheus(self) -> str:
+        """The snapshot in the Prometheus text exposition format"""
+        snap = self.snapshot()
+        lines = [f"# TYPE {PREFIX}_uptime_seconds gauge", f"{PREFIX}_uptime_seconds {snap['uptime_seconds']:.3f}",
+                 f"# TYPE {PREFIX}_responses_total counter"]
+        lines += [f'{PREFIX}_responses_total{{status="{status}"}} {count}' for status, count in snap["responses"].items()]
+        lines.append(f"# TYPE {PREFIX}_retries_total counter")
+        lines += [f'{PREFIX}_retries_total{{reason="{reason}"}} {count}' for reason, count in snap["retries"].items()]
+        lines += [f"# TYPE {PREFIX}_rate_limited_total counter", f"{PREFIX}_rate_limited_total {snap['rate_limited']}",
+                  f"# TYPE {PREFIX}_received_bytes_total counter", f"{PREFIX}_received_bytes_total {snap['bytes_received']}",
+                  f"# TYPE {PREFIX}_page_cache_hits_total counter", f"{PREFIX}_page_cache_hits_total {snap['page_cache_hits']}"]
+        lines += prometheus_histogram(f"{PREFIX}_request_duration_seconds", snap["request_seconds"])
+        lines += prometheus_histogram(f"{PREFIX}_json_decode_seconds", snap["json_decode_seconds"])
+        for name, key, kind in (("thread_messages_total", "messages", "counter"), ("thread_pages_total", "pages", "counter"),
+                                ("thread_requests_total", "requests", "counter"),
+                                ("thread_messages_per_second", "messages_per_second", "gauge")):
+            lines.append(f"# TYPE {PREFIX}_{name} {kind}")
+            lines += [f'{PREFIX}_{name}{{thread_id="{thread_id}"}} {stats[key]:g}'
+                      for thread_id, stats in snap["threads"].items()]
+        return "\n".join(lines) + "\n"
+
+    def write(self, path: str):
+        """Write the stats file: Prometheus text for .prom/.txt files, JSON otherwise"""
+        if path.endswith((".prom", ".txt")):
+            atomic_write(path, self.to_prometheus())
+        else:
+            atomic_write(path, json.dumps(self.snapshot(), indent=2))
+
+
+def prometheus_histogram(name: str, histogram: dict) -> list:
+    lines = [f"# TYPE {name} histogram"]
+    cumulative = 0
+    for bound, count in histogram["buckets"].items():
+        cumulative += count
+        lines.append(f'{name}_bucket{{le="{bound}"}} {cumulative}')
+    lines += [f"{name}_sum {histogram['sum']:.6f}", f"{name}_count {histogram['count']}"]
+    return lines
+
+
+def serve_metrics(metrics: Metrics, port: int) -> ThreadingHTTPServer:
+    """Serve /metrics (Prometheus text) and /stats.json on localhost from a background thread"""
+
+    class Handler(BaseHTTPRequestHandler):
+        def log_message(self, *args):
+            pass
+
+        def do_GET(self):
+            if self.path == "/metrics":
+                body, content_type = metrics.to_prometheus(), "text/plain; version=0.0.4"
+            elif self.path == "/stats.json":
+                body, content_type = json.dumps(metrics.snapshot()), "application/json"
+            else:
+                self.send_error(404)
+                return
+            data = body.encode()
+            self.send_response(200)
+            self.send_header("Content-Type", content_type)
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+    server = ThreadingHTTPServer(("127.0.0.1", port), Handler)
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
@@ -0,0 +1,81 @@
+import threading
+import time
+import zlib
+
+from shared_db import connect_shared
+
+DEFAULT_PAGE_CACHE = "page_cache.db"
+DEFAULT_CACHE_TTL = 7 * 24 * 3600  # Seconds
+DEFAULT_CACHE_SIZE = 512  # MB
+COMPRESS_LEVEL = 6
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    thread_id TEXT NOT NULL,
+    cursor TEXT NOT NULL,
+    fetched_at REAL NOT NULL,
+    used_at REAL NOT NULL,
+    size INTEGER NOT NULL,
+    body BLOB NOT NULL,
+    PRIMARY KEY (thread_id, cursor)
+);
+CREATE INDEX IF NOT EXISTS pages_by_use ON pages (used_at);
+"""
+
+
+class PageCache:
+    """Raw thread page responses on disk, keyed by thread and cursor.
+
+    Bodies are stored zlib-compressed exactly as they came from the API, so
+    a replayed page goes through the same decoding as a fetched one. Pages
+    older than the TTL are treated as missing, and once the compressed
+    bodies take more than max_bytes the least recently used pages are
+    dropped.
+    """
+
+    def __init__(self, path: str = DEFAULT_PAGE_CACHE, ttl: float = DEFAULT_CACHE_TTL,
+                 max_bytes: int = DEFAULT_CACHE_SIZE * 1024 * 1024):
+        self.path = path
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self.conn = connect_shared(path, SCHEMA)
+        self._lock = threading.Lock()
+        self.size = self.conn.execute("SELECT COALESCE(SUM(size), 0) FROM pages").fetchone()[0]
+
+    def get(self, thread_id: str, cursor: str, any_age: bool = False) -> bytes | None:
+        """The body cached for a page, None if there is none or it's older than the TTL (unless any_age)"""
+        now = time.time()
+        with self._lock:
+            row = self.conn.execute("SELECT fetched_at, body FROM pages WHERE thread_id = ? AND cursor = ?",
+                                    (thread_id, cursor)).fetchone()
+            if row is None or (not any_age and now - row[0] > self.ttl):
+                return None
+            with self.conn:
+                self.conn.execute("UPDATE pages SET used_at = ? WHERE thread_id = ? AND cursor = ?",
+                                  (now, thread_id, cursor))
+        return zlib.decompress(row[1])
+
+    def put(self, thread_id: str, cursor: str, body: bytes):
+        data = zlib.compress(body, COMPRESS_LEVEL)
+        now = time.time()
+        with self._lock, self.conn:
+            old = self.conn.execute("SELECT size FROM pages WHERE thread_id = ? AND cursor = ?",
+                                    (thread_id, cursor)).fetchone()
+            self.conn.execute("INSERT OR REPLACE INTO pages (thread_id, cursor, fetched_at, used_at, size, body) "
+                              "VALUES (?, ?, ?, ?, ?, ?)", (thread_id, cursor, now, now, len(data), data))
+            self.size += len(data) - (old[0] if old else 0)
+            if self.size > self.max_bytes:
+                self._evict()
+
+    def _evict(self):
+        """Drop least recently used pages until the cache fits in max_bytes again"""
+        doomed = []
+        for thread_id, cursor, size in self.conn.execute("SELECT thread_id, cursor, size FROM pages ORDER BY used_at"):
+            if self.size <= self.max_bytes:
+                break
+            doomed.append((thread_id, cursor))
+            self.size -= size
+        self.conn.executemany("DELETE FROM pages WHERE thread_id = ? AND cursor = ?", doomed)
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,128 @@
+import asyncio
+import random
+import threading
+import time
+from datetime import datetime, timezone
+from email.utils import parsedate_to_datetime
+
+DEFAULT_RATE = 1.0
+DEFAULT_MIN_RATE = 0.1
+DEFAULT_MAX_RATE = 4.0
+DEFAULT_BURST = 2
+DEFAULT_MAX_RETRIES = 6
+DEFAULT_MAX_BACKOFF = 300.0
+DEFAULT_POLL_MIN = 2.0
+DEFAULT_POLL_MAX = 60.0
+
+
+def parse_retry_after(value: str | None) -> float | None:
+    """Parse a Retry-After header (seconds or HTTP date) into seconds to wait"""
+    if not value:
+        return None
+    value = value.strip()
+    if value.isdigit():
+        return float(value)
+    try:
+        when = parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if when.tzinfo is None:
+        when = when.replace(tzinfo=timezone.utc)
+    return max(0.0, (when - datetime.now(timezone.utc)).total_seconds())
+
+
+class RateGovernor:
+    """Token bucket that paces requests and adapts its rate to the responses.
+
+    Every request takes one token. Healthy responses slowly raise the refill
+    rate up to max_rate; a 429 or 5xx cuts it (multiplicatively) down towards
+    min_rate. Thread-safe, so several scrapes can share one account budget.
+    """
+
+    def __init__(self, rate: float = DEFAULT_RATE, min_rate: float = DEFAULT_MIN_RATE,
+                 max_rate: float = DEFAULT_MAX_RATE, burst: int = DEFAULT_BURST,
+                 max_retries: int = DEFAULT_MAX_RETRIES, max_backoff: float = DEFAULT_MAX_BACKOFF,
+                 speedup: float = 1.05, slowdown: float = 0.5, base_backoff: float = 2.0):
+        self.min_rate = min_rate
+        self.max_rate = max(max_rate, min_rate)
+        self.rate = min(max(rate, self.min_rate), self.max_rate)
+        self.burst = max(1, burst)
+        self.max_retries = max_retries
+        self.max_backoff = max_backoff
+        self.speedup = speedup
+        self.slowdown = slowdown
+        self.base_backoff = base_backoff
+
+        self._tokens = 1.0
+        self._last = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self):
+        now = time.monotonic()
+        self._tokens = min(self.burst, self._tokens + (now - self._last) * self.rate)
+        self._last = now
+
+    def acquire(self):
+        """Block until a request token is available"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            time.sleep(wait)
+
+    async def acquire_async(self):
+        """acquire() for the asyncio engine, waits without blocking the loop"""
+        while True:
+            with self._lock:
+                self._refill()
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                wait = (1 - self._tokens) / self.rate
+            await asyncio.sleep(wait)
+
+    def on_success(self):
+        with self._lock:
+            self.rate = min(self.max_rate, self.rate * self.speedup)
+
+    def on_throttle(self):
+        """Called on a 429 or 5xx: slow down and drop any saved-up burst"""
+        with self._lock:
+            self.rate = max(self.min_rate, self.rate * self.slowdown)
+            self._tokens = min(self._tokens, 0.0)
+
+    def backoff(self, attempt: int, retry_after: float | None = None) -> float:
+        """Seconds to wait before retry number `attempt` (0-based)"""
+        if retry_after is not None:
+            # Respect the server, plus a little jitter so workers don't retry in lockstep
+            return min(self.max_backoff, retry_after) + random.uniform(0, 1)
+        ceiling = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+        return random.uniform(ceiling / 2, ceiling)
+
+
+class PollInterval:
+    """Seconds to wait between two polls of a live chat.
+
+    A poll that brings new messages snaps the interval back to min_interval;
+    every empty (or failed) poll stretches it by `factor`, up to
+    max_interval, so idle chats cost almost no requests.
+    """
+
+    def __init__(self, min_interval: float = DEFAULT_POLL_MIN, max_interval: float = DEFAULT_POLL_MAX,
+                 factor: float = 1.5):
+        self.min_interval = min_interval
+        self.max_interval = max(max_interval, min_interval)
+        self.factor = factor
+        self.current = self.min_interval
+
+    def update(self, new_messages: int) -> float:
+        """Feed the result of a poll, returns the seconds until the next one"""
+        if new_messages:
+            self.current = self.min_interval
+        else:
+            self.current = min(self.max_interval, self.current * self.factor)
+        # A little jitter so chats that went idle together don't keep polling in lockstep
+        return self.current * random.uniform(0.9, 1.1)
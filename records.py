@@ -0,0 +1,85 @@
+RAVEN_EXPIRED_SUFFIX = " (May be expired)"
+
+
+class MessageRecord:
+    """Compact stand-in for a raw API item, built once when a page is ingested.
+
+    Keeps only what the exporters use; the nested media payloads are dropped
+    unless keep_raw is set (then the original dict is kept in `raw`).
+    """
+
+    __slots__ = ("item_id", "user_id", "timestamp", "item_type", "text", "url", "raw")
+
+    def __init__(self, item_id: str, user_id, timestamp: int, item_type: str, text: str,
+                 url: str | None = None, raw: dict | None = None):
+        self.item_id = item_id
+        self.user_id = user_id
+        self.timestamp = timestamp
+        self.item_type = item_type
+        self.text = text
+        self.url = url
+        self.raw = raw
+
+    @classmethod
+    def from_item(cls, item: dict, keep_raw: bool = False) -> "MessageRecord":
+        """Build a record from an API item, or from a dict made by to_dict()"""
+        if "url" in item:  # Already compact (checkpoint or store)
+            text, url = item["text"], item["url"]
+            raw = item.get("raw") if keep_raw else None
+        else:
+            text, url = extract_content(item)
+            raw = item if keep_raw else None
+        return cls(item["item_id"], item.get("user_id"), int(item["timestamp"]), item.get("item_type", ""),
+                   text, url, raw)
+
+    def to_dict(self) -> dict:
+        data = {"item_id": self.item_id, "user_id": self.user_id, "timestamp": self.timestamp,
+                "item_type": self.item_type, "text": self.text, "url": self.url}
+        if self.raw is not None:
+            data["raw"] = self.raw
+        return data
+
+    def __repr__(self):
+        return f"MessageRecord({self.item_id!r}, {self.item_type!r}, {self.timestamp})"
+
+
+def extract_content(msg: dict):
+    """(text, url) of a raw API item, text being the label when there is a url"""
+    item_type = msg.get('item_type', '')
+    
+    if item_type == 'text':
+        return msg.get('text', ''), None
+    
+    elif item_type == 'media':
+        media_type = msg.get('media', {}).get('media_type')
+        if media_type == 1:
+            return "Photo", msg['media']['image_versions2']['candidates'][0]['url']
+        elif media_type == 2:
+            return "Video", msg['media']['video_versions'][0]['url']
+    
+    elif item_type == 'media_share':
+        try:
+            user = msg['media_share']['user']['username']
+            name = msg['media_share']['user']['full_name']
+            code = msg['media_share']['code']
+            return f"Post share from {user} (A.K.A {name})", f"https://instagram.com/p/{code}/"
+        except KeyError:
+            return "Post share: Unable to get post", None
+    
+    elif item_type == 'voice_media':
+        return "Voice message", msg['voice_media']['media']['audio']['audio_src']
+    
+    elif item_type == 'raven_media':
+        media_type = msg.get('visual_media', {}).get('media', {}).get('media_type')
+        if media_type == 1:
+            try:
+                return "Temporary photo", msg['visual_media']['media']['image_versions2']['candidates'][0]['url']
+            except KeyError:
+                return "Temporary photo: Unable to fetch (Expired)", None
+        elif media_type == 2:
+            try:
+                return "Temporary video", msg['visual_media']['media']['video_versions'][0]['url']
+            except KeyError:
+                return "Temporary video: Unable to fetch (Expired)", None
+    
+    return item_type, None
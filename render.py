@@ -0,0 +1,148 @@
+import os
+import shlex
+import subprocess
+import sys
+from datetime import datetime
+
+from termcolor import colored
+
+from records import MessageRecord, RAVEN_EXPIRED_SUFFIX
+
+DEFAULT_TIME_FORMAT = "%d/%m/%Y @ %H:%M:%S"
+CONSOLE_BATCH = 500  # Lines per write to the console
+
+# Presets for --template; anything else is used as a str.format template with
+# the fields {name}, {text}, {time}, {type}, {id} and {url}
+LINE_TEMPLATES = {
+    "default": "{name}: {text} [{time}]",
+    "compact": "[{time}] {name}: {text}",
+    "chat": "{time} <{name}> {text}",
+}
+
+def format_message(msg: MessageRecord):
+    """Format message based on type"""
+    if msg.url is None:
+        return msg.text
+    suffix = RAVEN_EXPIRED_SUFFIX if msg.item_type == 'raven_media' else ""
+    return f"{msg.text}: {msg.url}{suffix}"
+
+
+def resolve_template(template: str) -> str:
+    """The line template for a --template value, raises ValueError if it doesn't render"""
+    template = LINE_TEMPLATES.get(template, template)
+    try:
+        template.format(name="", text="", time="", type="", id="", url="")
+    except (KeyError, IndexError) as e:
+        raise ValueError(f"Unknown field {e} in line template") from None
+    return template
+
+
+def color_enabled(stream) -> bool:
+    """Whether to color output going to stream, following the NO_COLOR and FORCE_COLOR conventions"""
+    if "NO_COLOR" in os.environ:
+        return False
+    if "FORCE_COLOR" in os.environ:
+        return True
+    return hasattr(stream, "isatty") and stream.isatty()
+
+
+class TimestampCache:
+    """strftime for API timestamps (microseconds) that formats each second only once.
+
+    Messages often come in bursts within the same second, and lines are
+    rendered in time order, so remembering the last second is enough.
+    """
+
+    def __init__(self, time_format: str = DEFAULT_TIME_FORMAT):
+        self.time_format = time_format
+        self._key = None
+        self._value = None
+
+    def __call__(self, timestamp: int) -> str:
+        seconds = timestamp // 1000000
+        if seconds != self._key:
+            self._key, self._value = seconds, datetime.fromtimestamp(seconds).strftime(self.time_format)
+        return self._value
+
+
+class LineRenderer:
+    """Turns MessageRecords into text lines with a line template.
+
+    Names come from members (user id: name, anyone else is "You"), looked up
+    in the dict itself so names added later are picked up. With color set
+    the name is colored.
+    """
+
+    def __init__(self, members: dict, template: str = LINE_TEMPLATES["default"],
+                 time_format: str = DEFAULT_TIME_FORMAT, color: bool = False, prefix: str = ""):
+        self.members = members
+        self.template = template
+        self.color = color
+        self.prefix = prefix
+        self._format = template.format
+        self._times = TimestampCache(time_format)
+        self._colored: dict = {}
+
+    def _name(self, user_id) -> str:
+        name = self.members.get(user_id, "You")
+        if not self.color:
+            return name
+        if name not in self._colored:
+            self._colored[name] = colored(name, "yellow", force_color=True)
+        return self._colored[name]
+
+    def __call__(self, msg: MessageRecord) -> str:
+        line = self._format(name=self._name(msg.user_id), text=format_message(msg), time=self._times(msg.timestamp),
+                            type=msg.item_type, id=msg.item_id, url=msg.url or "")
+        return f"{self.prefix}{line}" if self.prefix else line
+
+
+class ConsoleWriter:
+    """Console output written CONSOLE_BATCH lines at a time instead of one print() per line.
+
+    With a pager command (e.g. "less -R") the lines are piped into it
+    instead; once the pager is quit everything else is dropped. Colors are
+    on when stdout is a terminal (see color_enabled).
+    """
+
+    def __init__(self, pager: str | None = None, batch: int = CONSOLE_BATCH):
+        self.batch = batch
+        self.color = color_enabled(sys.stdout)
+        self.closed = False
+        self._lines: list = []
+        self._process = None
+        if pager:
+            self._process = subprocess.Popen(shlex.split(pager), stdin=subprocess.PIPE, text=True, encoding="UTF-8")
+            self.stream = self._process.stdin
+        else:
+            self.stream = sys.stdout
+
+    def write(self, line: str):
+        self._lines.append(line)
+        if len(self._lines) >= self.batch:
+            self.flush()
+
+    def flush(self):
+        lines, self._lines = self._lines, []
+        if not lines or self.closed:
+            return
+        try:
+            self.stream.write("\n".join(lines) + "\n")
+            self.stream.flush()
+        except BrokenPipeError:  # The pager was quit
+            self.closed = True
+
+    def close(self):
+        self.flush()
+        if self._process is not None:
+            try:
+                self.stream.close()
+            except BrokenPipeError:
+                pass
+            self._process.wait()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
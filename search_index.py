@@ -0,0 +1,105 @@
+import threading
+
+from shared_db import connect_shared
+
+DEFAULT_SEARCH_INDEX = "search.db"
+DEFAULT_SEARCH_LIMIT = 100
+
+# messages holds one row per (thread, item); messages_fts indexes its text and
+# sender. Rows are only ever added, so the rows new to messages are the ones
+# past its highest id and are indexed in one INSERT ... SELECT per batch (a
+# trigger indexing row by row costs several times more).
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS messages (
+    id INTEGER PRIMARY KEY,
+    item_id TEXT NOT NULL,
+    thread_id TEXT NOT NULL,
+    sender_id TEXT,
+    sender TEXT NOT NULL,
+    type TEXT NOT NULL,
+    text TEXT,
+    url TEXT,
+    timestamp INTEGER NOT NULL,
+    UNIQUE (thread_id, item_id)
+);
+CREATE INDEX IF NOT EXISTS messages_by_time ON messages (timestamp);
+CREATE VIRTUAL TABLE IF NOT EXISTS messages_fts USING fts5(
+    text, sender, content='messages', content_rowid='id', tokenize='unicode61 remove_diacritics 2'
+);
+"""
+
+
+class SearchIndex:
+    """SQLite FTS5 index of scraped messages across every chat.
+
+    Rows are the normalized export rows (export.EXPORT_FIELDS) and are
+    added page by page while chats are scraped, so the index grows with
+    every run.
+    """
+
+    def __init__(self, path: str = DEFAULT_SEARCH_INDEX):
+        self.path = path
+        self.conn = connect_shared(path, SCHEMA)
+        self._lock = threading.Lock()
+
+    def add(self, rows: list) -> int:
+        """Index export rows not indexed yet, returns how many were new"""
+        with self._lock, self.conn:
+            last_id = self.conn.execute("SELECT COALESCE(MAX(id), 0) FROM messages").fetchone()[0]
+            cursor = self.conn.executemany(
+                "INSERT OR IGNORE INTO messages (item_id, thread_id, sender_id, sender, type, text, url, timestamp) "
+                "VALUES (?, ?, ?, ?, ?, ?, ?, ?)",
+                ((item_id, thread_id, None if sender_id is None else str(sender_id), sender, item_type, text, url, timestamp)
+                 for item_id, thread_id, sender_id, sender, item_type, text, url, timestamp in rows),
+            )
+            if cursor.rowcount:
+                self.conn.execute("INSERT INTO messages_fts (rowid, text, sender) "
+                                  "SELECT id, text, sender FROM messages WHERE id > ?", (last_id,))
+            return cursor.rowcount
+
+    def search(self, query: str = "", sender: str | None = None, thread_ids: list | None = None,
+               item_type: str | None = None, since: int | None = None, until: int | None = None,
+               limit: int = DEFAULT_SEARCH_LIMIT) -> list:
+        """Matching messages as dicts, newest first.
+
+        query uses the FTS5 syntax ("a phrase", word*, a OR b, NEAR(...));
+        an empty query only applies the filters. sender matches the sender's
+        name (case-insensitive) or id, since and until are timestamps in
+        microseconds. Raises sqlite3.OperationalError on a malformed query.
+        """
+        clauses, params = [], []
+        if query:
+            clauses.append("m.id IN (SELECT rowid FROM messages_fts WHERE messages_fts MATCH ?)")
+            params.append(query)
+        if sender is not None:
+            clauses.append("(m.sender = ? COLLATE NOCASE OR m.sender_id = ?)")
+            params += [sender, sender]
+        if thread_ids:
+            clauses.append(f"m.thread_id IN ({', '.join('?' * len(thread_ids))})")
+            params += thread_ids
+        if item_type is not None:
+            clauses.append("m.type = ?")
+            params.append(item_type)
+        if since is not None:
+            clauses.append("m.timestamp >= ?")
+            params.append(since)
+        if until is not None:
+            clauses.append("m.timestamp <= ?")
+            params.append(until)
+
+        where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+        with self._lock:
+            cursor = self.conn.execute(
+                f"SELECT m.item_id, m.thread_id, m.sender_id, m.sender, m.type, m.text, m.url, m.timestamp "
+                f"FROM messages m {where} ORDER BY m.timestamp DESC LIMIT ?",
+                (*params, limit),
+            )
+            names = [column[0] for column in cursor.description]
+            return [dict(zip(names, row)) for row in cursor]
+
+    def count(self) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM messages").fetchone()[0]
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,15 @@
+import sqlite3
+
+
+def connect_shared(path: str, schema: str) -> sqlite3.Connection:
+    """Open a SQLite file that the worker threads share and create its schema.
+
+    WAL with synchronous=NORMAL keeps the many small write transactions
+    cheap. The connection isn't tied to the thread that opened it, so its
+    owner has to put every access behind a lock of its own.
+    """
+    conn = sqlite3.connect(path, check_same_thread=False)
+    conn.execute("PRAGMA journal_mode=WAL")
+    conn.execute("PRAGMA synchronous=NORMAL")
+    conn.executescript(schema)
+    return conn